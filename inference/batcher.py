@@ -0,0 +1,228 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+
+def length_buckets(lengths: list[int], max_batch_size: int, max_batch_length: int = 0) -> list[list[int]]:
+    """
+    按长度分桶，减少 padding 浪费
+    按长度升序排列后切分，每个桶最多 max_batch_size 条，
+    且 桶内最大长度 * 条数 不超过 max_batch_length(0 表示不限制)
+    返回每个桶内元素在原列表中的下标
+    """
+    buckets = []
+    bucket = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        full = len(bucket) >= max_batch_size
+        if max_batch_length > 0 and len(bucket) > 0:
+            full = full or (len(bucket) + 1) * lengths[index] > max_batch_length
+        if full:
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(index)
+    if len(bucket) > 0:
+        buckets.append(bucket)
+    return buckets
+
+
+# 优先级：interactive 为查询时的交互请求，batch 为入库等批量请求
+PRIORITIES = ("interactive", "batch")
+
+
+class _BatchRequest:
+    def __init__(self, items: list, future: asyncio.Future):
+        self.items = items
+        self.future = future
+        self.enqueued = time.perf_counter()
+
+
+class BatchMetrics:
+    """批处理统计：批大小和排队等待时间"""
+
+    def __init__(self):
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.run_time_total = 0.0
+
+    def record(self, batch: list[_BatchRequest], started: float, finished: float):
+        size = sum(len(r.items) for r in batch)
+        self.requests += len(batch)
+        self.batches += 1
+        self.items += size
+        self.max_batch_size = max(self.max_batch_size, size)
+        for r in batch:
+            wait = started - r.enqueued
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+        self.run_time_total += finished - started
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "avg_queue_wait_ms": self.queue_wait_total / self.requests * 1000 if self.requests else 0,
+            "max_queue_wait_ms": self.queue_wait_max * 1000,
+            "avg_run_time_ms": self.run_time_total / self.batches * 1000 if self.batches else 0,
+        }
+
+
+class DynamicBatcher:
+    """
+    动态批处理队列
+    并发请求先进入队列，凑够 max_batch_size 条或等待超过 max_wait_ms 后合并为一次 fn 调用，
+    再按请求拆分结果返回给各自的调用方。
+    fn: 同步函数，入参为所有请求拼接后的列表，返回等长的结果列表，在 executor 中执行
+
+    interactive 和 batch 两类请求分别排队，同一批只包含一类请求，优先调度 interactive；
+    interactive 连续调度 max_interactive_streak 批，或 batch 队首等待超过 max_batch_wait_ms 时，
+    调度一批 batch 请求，避免批量请求饿死
+    """
+
+    def __init__(self, name: str, fn: Callable[[list], list], executor: Optional[Executor] = None,
+                 max_batch_size: int = 64, max_wait_ms: float = 10, max_concurrent_batches: int = 1,
+                 max_interactive_streak: int = 4, max_batch_wait_ms: float = 1000):
+        self.name = name
+        self.fn = fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_interactive_streak = max_interactive_streak
+        self.max_batch_wait = max_batch_wait_ms / 1000
+        self.metrics = BatchMetrics()
+        self.priority_metrics = {p: BatchMetrics() for p in PRIORITIES}
+        self._queues: dict[str, deque[_BatchRequest]] = {p: deque() for p in PRIORITIES}
+        self._arrival: Optional[asyncio.Event] = None
+        self._streak = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        # 执行中的批次任务，保留引用避免被垃圾回收
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        self._arrival = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._worker = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def submit(self, items: list, priority: str = "interactive") -> list:
+        """提交一次请求，返回与 items 等长的结果"""
+        if priority not in self._queues:
+            raise ValueError(f"unknown priority: {priority}")
+        if len(items) == 0:
+            return []
+        # 超过 max_batch_size 的请求拆成多段排队，避免单个请求形成超大批次
+        loop = asyncio.get_running_loop()
+        futures = []
+        for start in range(0, len(items), self.max_batch_size):
+            future = loop.create_future()
+            self._queues[priority].append(_BatchRequest(items[start:start + self.max_batch_size], future))
+            futures.append(future)
+        self._arrival.set()
+        results = await asyncio.gather(*futures)
+        return [result for chunk in results for result in chunk]
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics.to_dict(),
+            "queue_depth": sum(len(q) for q in self._queues.values()),
+            "priorities": {
+                p: {
+                    "queue_depth": len(self._queues[p]),
+                    "queued_items": sum(len(r.items) for r in self._queues[p]),
+                    **self.priority_metrics[p].to_dict(),
+                }
+                for p in PRIORITIES
+            },
+        }
+
+    def _pick(self) -> str:
+        interactive, bulk = self._queues["interactive"], self._queues["batch"]
+        if len(bulk) == 0:
+            return "interactive"
+        if len(interactive) == 0:
+            return "batch"
+        if self._streak >= self.max_interactive_streak \
+                or time.perf_counter() - bulk[0].enqueued > self.max_batch_wait:
+            return "batch"
+        return "interactive"
+
+    async def _wait_arrival(self, timeout: Optional[float] = None) -> bool:
+        self._arrival.clear()
+        try:
+            await asyncio.wait_for(self._arrival.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _next_batch(self) -> tuple[str, list[_BatchRequest]]:
+        while all(len(q) == 0 for q in self._queues.values()):
+            await self._wait_arrival()
+        priority = self._pick()
+        self._streak = self._streak + 1 if priority == "interactive" else 0
+        queue = self._queues[priority]
+        first = queue.popleft()
+        batch = [first]
+        size = len(first.items)
+        deadline = first.enqueued + self.max_wait
+        while size < self.max_batch_size:
+            if len(queue) == 0:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0 or not await self._wait_arrival(timeout):
+                    break
+                continue
+            if size + len(queue[0].items) > self.max_batch_size:
+                # 超出批大小的请求留到下一批
+                break
+            request = queue.popleft()
+            batch.append(request)
+            size += len(request.items)
+        return priority, batch
+
+    async def _loop(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                priority, batch = await self._next_batch()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._run(priority, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, priority: str, batch: list[_BatchRequest]):
+        try:
+            items: list[Any] = [item for r in batch for item in r.items]
+            started = time.perf_counter()
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, self.fn, items)
+            except Exception as e:
+                for r in batch:
+                    if not r.future.done():
+                        r.future.set_exception(e)
+                return
+            finished = time.perf_counter()
+            self.metrics.record(batch, started, finished)
+            self.priority_metrics[priority].record(batch, started, finished)
+
+            offset = 0
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_result(results[offset:offset + len(r.items)])
+                offset += len(r.items)
+        finally:
+            self._slots.release()
@@ -0,0 +1,261 @@
+"""
+嵌入和重排模型的一致性校验与吞吐测试
+
+python benchmark.py backend --embedding-path BAAI/bge-m3 --rerank-path BAAI/bge-reranker-v2-m3 [--corpus pairs.jsonl]
+    在 CPU 上对比 torch 与 int8 后端的输出差异和吞吐，差异超过阈值时以非 0 状态码退出
+    除向量余弦相似度外，还对比两个后端的检索召回(recall@k、top-k 重合率)和重排排序一致性(Spearman、top-1)
+    --corpus 为 jsonl 文件，每行 {"query": ..., "passage": ...}，不传时使用内置的中英文样例
+
+python benchmark.py bucketing --embedding-path BAAI/bge-m3
+    在长短混合的语料上对比直接 encode 与按 token 长度分桶编码的吞吐，并校验两者结果一致
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+from models.FlagEmbeddingModels import FlagEmbeddingModelManager, encode_by_length
+
+WORDS = ["知识库", "向量检索", "重排模型", "工业革命", "碳排放", "能源转型", "文档解析", "表格", "大模型",
+         "retrieval", "embedding", "reranker", "document", "pipeline", "latency", "throughput", "index"]
+
+
+# 内置的中英文问答样例，query 对应的 passage 为相关文档，其余 passage 作为干扰项
+PARITY_SAMPLES = [
+    ("工业革命对碳排放有什么影响？",
+     "18世纪末开始的工业革命使煤炭成为主要能源，蒸汽机和工厂的普及让大气中的二氧化碳浓度持续上升，"
+     "这是近代温室气体排放快速增长的起点。"),
+    ("光伏发电的成本近十年下降了多少",
+     "根据国际可再生能源署的统计，2010年至2020年间全球光伏发电的平准化度电成本下降了约85%，"
+     "在多数国家已经低于新建燃煤电厂。"),
+    ("合同到期后如何办理续签手续",
+     "劳动合同期满前三十日，用人单位应当书面通知劳动者是否续订。双方同意续订的，应重新签订书面劳动合同，"
+     "并在人事系统中更新合同期限。"),
+    ("报销差旅费需要提交哪些材料",
+     "员工出差返回后十个工作日内提交报销申请，需附交通票据、住宿发票和经部门负责人审批的出差申请单，"
+     "超标准部分由个人承担。"),
+    ("向量数据库和传统关系型数据库的区别",
+     "关系型数据库以行和列组织结构化数据，依靠 B+ 树索引做精确查询；向量数据库存储高维 embedding，"
+     "通过 HNSW、IVF 等近似最近邻索引按相似度检索。"),
+    ("Milvus 的 HNSW 索引参数怎么调",
+     "HNSW 索引的 M 决定每个节点的最大连接数，efConstruction 影响建索引时的搜索范围；"
+     "查询时调大 ef 可以提高召回率，但会增加延迟。"),
+    ("What causes inflation to rise?",
+     "Inflation typically rises when aggregate demand outpaces the economy's productive capacity, "
+     "or when supply shocks such as higher energy prices push up production costs across many industries."),
+    ("How does a reranker improve retrieval quality?",
+     "A cross-encoder reranker reads the query and each candidate passage together, so it can model "
+     "fine-grained interactions that a bi-encoder misses, and reorders the first-stage results by relevance."),
+    ("When was the Treaty of Westphalia signed?",
+     "The Peace of Westphalia, a series of treaties signed in Osnabrück and Münster in 1648, ended the "
+     "Thirty Years' War and established principles of state sovereignty in Europe."),
+    ("symptoms of vitamin D deficiency",
+     "Vitamin D deficiency often causes fatigue, bone pain and muscle weakness; in children it can lead to "
+     "rickets, while adults may develop osteomalacia or an increased risk of fractures."),
+    ("How do I rotate the API key without downtime?",
+     "Create a second key, deploy it to all clients alongside the old one, switch traffic to the new key, "
+     "and revoke the old key only after the access logs show it is no longer used."),
+    ("PDF 扫描件 OCR 识别率低怎么办",
+     "Scanned PDFs with low resolution or skewed pages often give poor OCR accuracy. 建议先将扫描分辨率提高到 300 DPI，"
+     "并做去噪和倾斜校正后再识别。"),
+    ("excel 表格里的合并单元格如何解析",
+     "When parsing spreadsheets, merged cells only keep their value in the top-left cell. "
+     "解析时需要读取合并区域，把左上角的值填充到区域内的每个单元格，才能保证表头与数据对齐。"),
+    ("大模型 RAG 系统为什么要做 query 改写",
+     "用户的原始问题往往口语化、指代不清，query rewriting 会结合对话上下文补全省略的信息并拆分出子问题，"
+     "从而提高 retrieval 的召回率。"),
+    ("東京の桜の見頃はいつですか",
+     "東京では例年3月下旬から4月上旬にかけて桜が見頃を迎え、上野公園や千鳥ヶ淵には多くの花見客が訪れます。"),
+    ("Quels sont les horaires d'ouverture du musée du Louvre ?",
+     "Le musée du Louvre est ouvert tous les jours sauf le mardi, de 9 h à 18 h, avec une nocturne "
+     "jusqu'à 21 h 45 le mercredi et le vendredi."),
+]
+
+
+def load_pairs(path: str) -> list[tuple[str, str]]:
+    """读取 jsonl 格式的 query-passage 对，未指定时使用内置样例"""
+    if path is None:
+        return PARITY_SAMPLES
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                pairs.append((item["query"], item["passage"]))
+    return pairs
+
+
+def make_corpus(size: int, min_words: int, max_words: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))) for _ in range(size)]
+
+
+def throughput(fn, items: list, repeat: int = 3) -> float:
+    fn(items[:8])  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(items)
+    return len(items) * repeat / (time.perf_counter() - start)
+
+
+def _sparse_overlap(a: dict, b: dict, top_k: int = 10) -> float:
+    top_a = set(sorted(a, key=a.get, reverse=True)[:top_k])
+    top_b = set(sorted(b, key=b.get, reverse=True)[:top_k])
+    return len(top_a & top_b) / max(1, len(top_a | top_b))
+
+
+def _lexical_scores(queries: list[dict], passages: list[dict]) -> np.ndarray:
+    """稀疏向量的词项匹配分数，与 milvus 稀疏检索的内积一致"""
+    return np.asarray([[sum(w * p.get(t, 0) for t, w in q.items()) for p in passages] for q in queries])
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def _retrieval_agreement(ref_scores: np.ndarray, q_scores: np.ndarray, k: int) -> tuple[float, float, float]:
+    """返回 (torch recall@k, int8 recall@k, 两个后端 top-k 结果的平均重合率)，第 i 个 query 的相关文档为第 i 个 passage"""
+    ref_top, q_top = _top_k(ref_scores, k), _top_k(q_scores, k)
+    gold = np.arange(len(ref_scores))[:, None]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, q_top)])
+    ref_recall = float(np.mean(np.any(ref_top == gold, axis=1)))
+    q_recall = float(np.mean(np.any(q_top == gold, axis=1)))
+    return ref_recall, q_recall, float(overlap)
+
+
+def _spearman(a: np.ndarray, b: np.ndarray) -> float:
+    rank_a, rank_b = np.argsort(np.argsort(a)), np.argsort(np.argsort(b))
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def backend_benchmark(args) -> bool:
+    samples = load_pairs(args.corpus)
+    queries = [q for q, _ in samples]
+    passages = [p for _, p in samples]
+    k = min(args.top_k, len(passages))
+
+    reference = FlagEmbeddingModelManager()
+    reference.load_embedding_model(model_path=args.embedding_path, device="cpu", backend="torch")
+    reference.load_rerank_model(model_path=args.rerank_path, device="cpu", backend="torch")
+    quantized = FlagEmbeddingModelManager()
+    quantized.load_embedding_model(model_path=args.embedding_path, device="cpu", backend="int8")
+    quantized.load_rerank_model(model_path=args.rerank_path, device="cpu", backend="int8")
+
+    texts = queries + passages
+    ref_embedding = reference.embedding_model.encode(texts, return_sparse=True)
+    q_embedding = quantized.embedding_model.encode(texts, return_sparse=True)
+    ref_dense, q_dense = np.asarray(ref_embedding['dense_vecs']), np.asarray(q_embedding['dense_vecs'])
+    cosine = np.sum(ref_dense * q_dense, axis=1) / (
+            np.linalg.norm(ref_dense, axis=1) * np.linalg.norm(q_dense, axis=1))
+    overlap = np.mean([_sparse_overlap(a, b) for a, b in
+                       zip(ref_embedding['lexical_weights'], q_embedding['lexical_weights'])])
+
+    # 用各自后端的向量检索，对比召回结果
+    n = len(queries)
+    dense_recall = _retrieval_agreement(ref_dense[:n] @ ref_dense[n:].T, q_dense[:n] @ q_dense[n:].T, k)
+    ref_lexical, q_lexical = ref_embedding['lexical_weights'], q_embedding['lexical_weights']
+    sparse_recall = _retrieval_agreement(_lexical_scores(ref_lexical[:n], ref_lexical[n:]),
+                                         _lexical_scores(q_lexical[:n], q_lexical[n:]), k)
+
+    # 每个 query 对 torch 召回的 top-k 候选重排，对比排序
+    candidates = _top_k(ref_dense[:n] @ ref_dense[n:].T, k)
+    pairs = [[queries[i], passages[j]] for i in range(n) for j in candidates[i]]
+    ref_scores = np.asarray(reference.rerank_model.compute_score(pairs, normalize=True)).reshape(n, k)
+    q_scores = np.asarray(quantized.rerank_model.compute_score(pairs, normalize=True)).reshape(n, k)
+    score_diff = np.abs(ref_scores - q_scores)
+    spearman = np.mean([_spearman(a, b) for a, b in zip(ref_scores, q_scores)]) if k > 1 else 1.0
+    top1 = np.mean(np.argmax(ref_scores, axis=1) == np.argmax(q_scores, axis=1))
+
+    print(f"corpus {n} query-passage pairs, top_k={k}")
+    print(f"dense cosine       mean={cosine.mean():.4f} min={cosine.min():.4f}")
+    print(f"sparse top10 jaccard mean={overlap:.4f}")
+    print(f"dense  recall@{k}    torch={dense_recall[0]:.4f} int8={dense_recall[1]:.4f} "
+          f"top-{k} overlap={dense_recall[2]:.4f}")
+    print(f"sparse recall@{k}    torch={sparse_recall[0]:.4f} int8={sparse_recall[1]:.4f} "
+          f"top-{k} overlap={sparse_recall[2]:.4f}")
+    print(f"rerank |diff|      mean={score_diff.mean():.4f} max={score_diff.max():.4f}")
+    print(f"rerank ranking     spearman={spearman:.4f} top1 agreement={top1:.4f}")
+
+    for name, manager in [("torch", reference), ("int8", quantized)]:
+        embed = throughput(lambda t: manager.embedding_model.encode(t, return_sparse=True), texts)
+        rerank = throughput(lambda p: manager.rerank_model.compute_score(p, normalize=True), pairs)
+        print(f"{name:6} embedding {embed:8.1f} texts/s   rerank {rerank:8.1f} pairs/s")
+
+    return cosine.min() >= args.min_cosine and overlap >= args.min_sparse_overlap \
+        and score_diff.max() <= args.max_rerank_diff \
+        and dense_recall[1] >= dense_recall[0] - args.max_recall_drop \
+        and sparse_recall[1] >= sparse_recall[0] - args.max_recall_drop \
+        and min(dense_recall[2], sparse_recall[2]) >= args.min_topk_overlap \
+        and spearman >= args.min_rank_correlation and top1 >= args.min_top1_agreement
+
+
+def bucketing_benchmark(args) -> bool:
+    # 大部分为短文本，少量长文本(如表格分块)
+    rng = random.Random(2)
+    long_size = int(args.size * args.long_ratio)
+    corpus = make_corpus(args.size - long_size, 4, 64) + make_corpus(long_size, 600, 1200, seed=3)
+    rng.shuffle(corpus)
+
+    manager = FlagEmbeddingModelManager()
+    manager.load_embedding_model(model_path=args.embedding_path, backend=args.backend)
+    model = manager.embedding_model
+
+    def plain(texts):
+        return model.encode(texts, batch_size=args.batch_size, return_sparse=True)
+
+    def bucketed(texts):
+        return encode_by_length(model, texts, max_length=args.max_length, batch_size=args.batch_size,
+                                max_batch_tokens=args.max_batch_tokens)
+
+    reference = plain(corpus)
+    result = bucketed(corpus)
+    ref_dense = np.asarray(reference['dense_vecs'])
+    dense = np.asarray([r['dense'] for r in result])
+    cosine = np.sum(ref_dense * dense, axis=1) / (np.linalg.norm(ref_dense, axis=1) * np.linalg.norm(dense, axis=1))
+    print(f"corpus {len(corpus)} texts, {long_size} long")
+    print(f"dense cosine       mean={cosine.mean():.4f} min={cosine.min():.4f}")
+    print(f"plain    {throughput(plain, corpus):8.1f} texts/s")
+    print(f"bucketed {throughput(bucketed, corpus):8.1f} texts/s")
+    return cosine.min() >= args.min_cosine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backend = sub.add_parser("backend", help="torch 与 int8 后端一致性校验和吞吐对比")
+    backend.add_argument("--embedding-path", default="BAAI/bge-m3")
+    backend.add_argument("--rerank-path", default="BAAI/bge-reranker-v2-m3")
+    backend.add_argument("--corpus", default=None, help="jsonl 文件，每行 {\"query\": ..., \"passage\": ...}")
+    backend.add_argument("--top-k", type=int, default=5)
+    backend.add_argument("--min-cosine", type=float, default=0.98)
+    backend.add_argument("--min-sparse-overlap", type=float, default=0.7)
+    backend.add_argument("--max-rerank-diff", type=float, default=0.05)
+    backend.add_argument("--max-recall-drop", type=float, default=0.02, help="int8 recall@k 相对 torch 的最大下降")
+    backend.add_argument("--min-topk-overlap", type=float, default=0.9)
+    backend.add_argument("--min-rank-correlation", type=float, default=0.9)
+    backend.add_argument("--min-top1-agreement", type=float, default=0.95)
+    backend.set_defaults(func=backend_benchmark)
+
+    bucketing = sub.add_parser("bucketing", help="按 token 长度分桶编码的吞吐对比")
+    bucketing.add_argument("--embedding-path", default="BAAI/bge-m3")
+    bucketing.add_argument("--backend", default="torch", choices=["torch", "int8"])
+    bucketing.add_argument("--size", type=int, default=512)
+    bucketing.add_argument("--long-ratio", type=float, default=0.05)
+    bucketing.add_argument("--batch-size", type=int, default=32)
+    bucketing.add_argument("--max-batch-tokens", type=int, default=16 * 1024)
+    bucketing.add_argument("--max-length", type=int, default=8192)
+    bucketing.add_argument("--min-cosine", type=float, default=0.99)
+    bucketing.set_defaults(func=bucketing_benchmark)
+
+    args = parser.parse_args()
+    if not args.func(args):
+        print("parity check failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
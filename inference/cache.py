@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class OcrCache:
+    """
+    OCR 结果缓存，key 为上传文件内容的 hash 加识别参数
+    结果以 json 文件保存在磁盘目录中，总大小超过 max_bytes 时按最近访问时间淘汰(LRU)
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> 文件大小，按最近访问时间排序
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        os.makedirs(path, exist_ok=True)
+        entries = []
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(path, name))
+                entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._size += size
+
+    @staticmethod
+    def key(digest: str, **options) -> str:
+        """digest: 文件内容的 sha256，options: 影响识别结果的参数"""
+        return hashlib.sha256(f"{digest}\0{json.dumps(options, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(self._file(key))
+        except (OSError, ValueError):
+            with self._lock:
+                self._size -= self._index.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        tmp = f"{self._file(key)}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._file(key))
+        with self._lock:
+            self._size += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._size > self.max_bytes and len(self._index) > 0:
+                evicted, size = self._index.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(self._file(evicted))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+            "entries": len(self._index),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,49 @@
+import struct
+
+import numpy as np
+
+MAGIC = b"EMB1"
+DTYPES = {"float32": 1, "float16": 2}
+FLAG_DENSE = 1
+FLAG_SPARSE = 2
+
+
+def _pad(buffer: bytearray):
+    # 每段按 4 字节对齐，方便接收端直接 np.frombuffer
+    buffer.extend(b"\0" * (-len(buffer) % 4))
+
+
+def encode_embeddings(results: list[dict], dense_flags: list[bool], sparse_flags: list[bool],
+                      dense_dtype: str = "float32") -> bytes:
+    """
+    嵌入结果的二进制编码，所有整数和浮点数均为小端序
+    header  : magic "EMB1" | n uint32 | dim uint32 | dtype uint8(1 float32, 2 float16) | 3字节保留
+    flags   : n 个 uint8，bit0 有密集向量，bit1 有稀疏向量
+    dense   : 有密集向量的文本按顺序排列的 n_dense * dim 矩阵
+    sparse  : offsets (n_sparse+1) uint32 | indices int32 | values float32，第 i 个稀疏向量为 offsets[i]:offsets[i+1]
+    """
+    n = len(results)
+    dense_rows = [r['dense'] for r, flag in zip(results, dense_flags) if flag]
+    sparse_rows = [r['sparse'] for r, flag in zip(results, sparse_flags) if flag]
+    dim = len(dense_rows[0]) if len(dense_rows) > 0 else 0
+
+    buffer = bytearray(struct.pack("<4sIIB3x", MAGIC, n, dim, DTYPES[dense_dtype]))
+    buffer.extend(bytes((FLAG_DENSE if d else 0) | (FLAG_SPARSE if s else 0)
+                        for d, s in zip(dense_flags, sparse_flags)))
+    _pad(buffer)
+
+    if len(dense_rows) > 0:
+        buffer.extend(np.asarray(dense_rows, dtype=dense_dtype).tobytes())
+        _pad(buffer)
+
+    if len(sparse_rows) > 0:
+        offsets = np.zeros(len(sparse_rows) + 1, dtype="<u4")
+        offsets[1:] = np.cumsum([len(s) for s in sparse_rows])
+        indices = np.fromiter((int(k) for s in sparse_rows for k in s.keys()), dtype="<i4", count=int(offsets[-1]))
+        values = np.fromiter((float(v) for s in sparse_rows for v in s.values()), dtype="<f4",
+                             count=int(offsets[-1]))
+        buffer.extend(offsets.tobytes())
+        buffer.extend(indices.tobytes())
+        buffer.extend(values.tobytes())
+
+    return bytes(buffer)
@@ -11,7 +11,47 @@ class Config:
         with open(config_path, 'r') as file:
             _config = yaml.safe_load(file)
             self.server = _config['server']
-            self.ocr = _config['ocr']
+            self.ocr = {
+                "pages_per_job": 16,
+                "max_concurrent_jobs": 4,
+                "spool_dir": "./ocr_spool",
+                **_config['ocr'],
+            }
+            self.ocr_cache = {
+                "enable": True,
+                "path": "./ocr_cache",
+                "max_bytes": 2 * 1024 ** 3,
+                **(_config.get('ocr_cache') or {}),
+            }
+            models = _config.get('models') or {}
+            self.models = {
+                "embedding": {"path": "BAAI/bge-m3", "backend": "torch", **(models.get('embedding') or {})},
+                "rerank": {"path": "BAAI/bge-reranker-v2-m3", "backend": "torch", **(models.get('rerank') or {})},
+                "replicas": models.get('replicas', 0),
+                "threads_per_replica": models.get('threads_per_replica', 0),
+            }
+            self.embedding = {
+                "max_batch_size": 64,
+                "batch_size": 32,
+                "max_batch_tokens": 16 * 1024,
+                "max_length": 8192,
+                "max_wait_ms": 10,
+                "max_concurrent_batches": 1,
+                "max_interactive_streak": 4,
+                "max_batch_wait_ms": 1000,
+                **(_config.get('embedding') or {}),
+            }
+            self.rerank = {
+                "max_queue_pairs": 256,
+                "max_wait_ms": 10,
+                "max_concurrent_batches": 1,
+                "max_interactive_streak": 4,
+                "max_batch_wait_ms": 1000,
+                "batch_size": 32,
+                "max_batch_length": 32 * 1024,
+                "max_length": 512,
+                **(_config.get('rerank') or {}),
+            }
 
 
 config = Config()
@@ -1,18 +1,30 @@
 import asyncio
 import base64
+import hashlib
 import io
+import json
+import math
 import multiprocessing
 import os
+import shutil
+import tempfile
 from asyncio import Queue
 from concurrent.futures import ProcessPoolExecutor
+from typing import Literal, Union
 
+import pypdfium2 as pdfium
 import torch
 import uvicorn
-from fastapi import FastAPI, UploadFile, File
-from fastapi import Request
+from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
 from marker.output import text_from_rendered
+from pydantic import BaseModel, model_validator
 
-from models.FlagEmbeddingModels import flag_embedding_model_manager
+from batcher import DynamicBatcher, length_buckets
+from cache import OcrCache
+from codec import encode_embeddings
+from models.FlagEmbeddingModels import flag_embedding_model_manager, encode_by_length
 from models.SuryaModel import suryaModel
 from config import config
 
@@ -30,6 +42,28 @@ def init_worker(device_queue: Queue):
         pid=pid)
 
 
+def init_model_worker(device_queue: Queue, threads: int):
+    """模型副本进程初始化，每个进程加载一份嵌入和重排模型"""
+    torch.set_num_threads(threads)
+    _load_models(device_queue.get())
+
+
+def _load_models(device: str = None):
+    kwargs = {} if device is None else {"device": device}
+    flag_embedding_model_manager.load_embedding_model(model_path=config.models['embedding']['path'],
+                                                      backend=config.models['embedding']['backend'], **kwargs)
+    flag_embedding_model_manager.load_rerank_model(model_path=config.models['rerank']['path'],
+                                                   backend=config.models['rerank']['backend'], **kwargs)
+
+
+def _embedding_task(texts):
+    return _embedding(flag_embedding_model_manager.embedding_model, texts)
+
+
+def _rerank_task(pairs):
+    return _rerank(flag_embedding_model_manager.rerank_model, pairs)
+
+
 def dummy_task():
     return None
 
@@ -56,6 +90,14 @@ async def startup_event():
             for _ in range(config.ocr['works']):
                 device_queue.put("cpu")
 
+    app.state.ocr_cache = OcrCache(path=config.ocr_cache['path'], max_bytes=config.ocr_cache['max_bytes']) \
+        if config.ocr_cache['enable'] else None
+
+    # 清理上次运行遗留的临时文件
+    shutil.rmtree(config.ocr['spool_dir'], ignore_errors=True)
+    os.makedirs(config.ocr['spool_dir'], exist_ok=True)
+    app.state.ocr_semaphore = asyncio.Semaphore(config.ocr['max_concurrent_jobs'])
+
     app.state.executor = ProcessPoolExecutor(
         max_workers=config.ocr['works'] * config.ocr['device'],
         initializer=init_worker,
@@ -65,58 +107,242 @@ async def startup_event():
     for future in futures:
         future.result()  # 等待完成
 
-    flag_embedding_model_manager.load_embedding_model()
-    flag_embedding_model_manager.load_rerank_model()
+    replicas = config.models['replicas']
+    app.state.model_executor = None
+    if replicas > 0:
+        # 每个模型副本一个进程，批处理由进程池分发给空闲的副本
+        model_device_queue = manager.Queue()
+        for i in range(replicas):
+            model_device_queue.put(f"cuda:{i % totalGPU}" if cuda_available else "cpu")
+        threads = config.models['threads_per_replica'] or max(1, os.cpu_count() // replicas)
+        app.state.model_executor = ProcessPoolExecutor(
+            max_workers=replicas,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_model_worker,
+            initargs=(model_device_queue, threads)
+        )
+        futures = [app.state.model_executor.submit(dummy_task) for _ in range(replicas)]
+        for future in futures:
+            future.result()  # 等待完成
+    else:
+        _load_models()
+    model_executor = app.state.model_executor or thread_executor
+
+    app.state.embedding_batcher = DynamicBatcher(
+        name="embedding",
+        fn=_embedding_task,
+        executor=model_executor,
+        max_batch_size=config.embedding['max_batch_size'],
+        max_wait_ms=config.embedding['max_wait_ms'],
+        max_concurrent_batches=replicas or config.embedding['max_concurrent_batches'],
+        max_interactive_streak=config.embedding['max_interactive_streak'],
+        max_batch_wait_ms=config.embedding['max_batch_wait_ms'],
+    )
+    app.state.embedding_batcher.start()
+
+    app.state.rerank_batcher = DynamicBatcher(
+        name="rerank",
+        fn=_rerank_task,
+        executor=model_executor,
+        max_batch_size=config.rerank['max_queue_pairs'],
+        max_wait_ms=config.rerank['max_wait_ms'],
+        max_concurrent_batches=replicas or config.rerank['max_concurrent_batches'],
+        max_interactive_streak=config.rerank['max_interactive_streak'],
+        max_batch_wait_ms=config.rerank['max_batch_wait_ms'],
+    )
+    app.state.rerank_batcher.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await app.state.embedding_batcher.stop()
+    await app.state.rerank_batcher.stop()
     app.state.executor.shutdown()
+    if app.state.model_executor is not None:
+        app.state.model_executor.shutdown()
+
 
+SPOOL_CHUNK_SIZE = 1024 * 1024
 
-def _ocr(_bytes):
+
+def _ocr(path: str, page_range: list[int] = None, return_images: bool = True, image_max_size: int = 0):
     pid = os.getpid()
-    model = suryaModel.models[pid]
-    rendered = model(_bytes)
+    rendered = suryaModel.convert(pid, path, page_range, extract_images=return_images)
     _text, _, _images = text_from_rendered(rendered)
+    if not return_images:
+        return _text, {}
     for key in _images.keys():
         image = _images[key]
+        if image_max_size > 0:
+            image.thumbnail((image_max_size, image_max_size))
         buffer = io.BytesIO()
         image.save(buffer, format="JPEG")
         _images[key] = base64.b64encode(buffer.getvalue()).decode("utf-8")
     return _text, _images
 
 
+def _parse_page_range(page_range: str, page_count: int) -> list[int]:
+    """解析页范围，如 "0-3,5"，页码从0开始，为空时返回全部页"""
+    if not page_range:
+        return list(range(page_count))
+    pages = set()
+    for part in page_range.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            pages.update(range(int(start), int(end) + 1))
+        elif part:
+            pages.add(int(part))
+    return sorted(p for p in pages if 0 <= p < page_count)
+
+
+def _page_ranges(pages: list[int]) -> list[list[int]]:
+    """
+    按进程数将页切分为页段，每段不超过 pages_per_job 页
+    页段不跨越不连续的页，调用方可以按每段的第一页放置识别结果
+    """
+    works = config.ocr['works'] * config.ocr['device']
+    size = max(1, min(config.ocr['pages_per_job'], math.ceil(len(pages) / works)))
+    runs = []
+    for page in pages:
+        if len(runs) > 0 and runs[-1][-1] == page - 1:
+            runs[-1].append(page)
+        else:
+            runs.append([page])
+    return [run[start:start + size] for run in runs for start in range(0, len(run), size)]
+
+
 @app.post("/ocr")
-async def ocr(file: UploadFile = File(...), request: Request = None):
-    data = await file.read()
-    loop = asyncio.get_event_loop()
-    executor = request.app.state.executor
+async def ocr(file: UploadFile = File(...),
+              page_range: str = Form(None),
+              return_images: bool = Form(True),
+              image_max_size: int = Form(0),
+              stream: bool = Form(False),
+              request: Request = None):
+    """
+    page_range: 仅 pdf 有效，只识别这些页，如 "0-3,5"，页码从0开始
+    return_images: 是否返回文档中的图片，为 false 时不提取、不编码图片
+    image_max_size: 返回图片的最大边长，超过时等比缩小，0 为原图
+    stream: 以 NDJSON 返回，pdf 每个页段识别完成后按页顺序返回一行 {"pages": [...], "text": ..., "images": ...}
+    """
+    path, digest, is_pdf = await asyncio.to_thread(_spool, file.file, file.filename)
+    options = {"page_range": page_range, "return_images": return_images, "image_max_size": image_max_size}
+    ocr_cache = request.app.state.ocr_cache
+    key = None
+    if ocr_cache is not None:
+        key = OcrCache.key(digest, **options)
+        result = await asyncio.to_thread(ocr_cache.get, key)
+        if result is not None:
+            os.remove(path)
+            if stream:
+                return StreamingResponse(_ndjson(_single({"pages": None, **result})),
+                                         media_type="application/x-ndjson")
+            return result
+
+    chunks = _ocr_chunks(path, is_pdf, request.app.state.ocr_semaphore, request.app.state.executor, **options)
+    if stream:
+        return StreamingResponse(_ndjson(chunks, ocr_cache, key), media_type="application/x-ndjson")
+    result = _merge_chunks([chunk async for chunk in chunks])
+    if ocr_cache is not None:
+        await asyncio.to_thread(ocr_cache.put, key, result)
+    return result
 
-    text, images = await loop.run_in_executor(executor, _ocr, io.BytesIO(data))
 
+def _spool(source, filename: str) -> tuple[str, str, bool]:
+    """
+    上传文件分块写入临时文件，同时计算 sha256，worker 进程只接收文件路径
+    返回 (路径, sha256, 是否 pdf)
+    """
+    digest = hashlib.sha256()
+    suffix = os.path.splitext(filename or "")[1]
+    with tempfile.NamedTemporaryFile(dir=config.ocr['spool_dir'], suffix=suffix, delete=False) as f:
+        head = b""
+        while chunk := source.read(SPOOL_CHUNK_SIZE):
+            if len(head) < 4:
+                head += chunk[:4]
+            digest.update(chunk)
+            f.write(chunk)
+    return f.name, digest.hexdigest(), head.startswith(b"%PDF")
+
+
+async def _ocr_chunks(path: str, is_pdf: bool, semaphore: asyncio.Semaphore, executor,
+                      page_range: str, return_images: bool, image_max_size: int):
+    """
+    按页顺序逐段返回识别结果 {"pages", "text", "images"}，非 pdf 只有一段且 pages 为 None
+    同时识别的文档数由 semaphore 限制，结束后删除临时文件
+    """
+    futures = []
+    try:
+        async with semaphore:
+            if not is_pdf:
+                futures.append(executor.submit(_ocr, path, None, return_images, image_max_size))
+                text, images = await asyncio.wrap_future(futures[0])
+                yield {"pages": None, "text": text, "images": images}
+                return
+
+            # pdf 按页段分发到所有进程并行识别，再按页顺序返回
+            pdf = pdfium.PdfDocument(path)
+            page_count = len(pdf)
+            pdf.close()
+            jobs = _page_ranges(_parse_page_range(page_range, page_count))
+            futures = [executor.submit(_ocr, path, pages_of_job, return_images, image_max_size)
+                       for pages_of_job in jobs]
+            for pages_of_job, future in zip(jobs, futures):
+                text, images = await asyncio.wrap_future(future)
+                yield {"pages": pages_of_job, "text": text, "images": images}
+    finally:
+        # 客户端断开或出错时，取消还未开始的页段，等正在识别的页段结束后再删除文件
+        for future in futures:
+            future.cancel()
+        await asyncio.gather(*[asyncio.wrap_future(f) for f in futures if not f.cancelled()],
+                             return_exceptions=True)
+        os.remove(path)
+
+
+async def _single(chunk: dict):
+    yield chunk
+
+
+def _merge_chunks(chunks: list[dict]) -> dict:
+    images = {}
+    for chunk in chunks:
+        images.update(chunk['images'])
     return {
-        "text": text,
+        "text": "\n\n".join(chunk['text'] for chunk in chunks if chunk['text']),
         "images": images
     }
 
 
-def _embedding(embedding_model, texts):
-    embeddings = embedding_model.encode(texts, return_sparse=True)
-    dense = embeddings['dense_vecs']
-    sparse = embeddings['lexical_weights']
-    result = []
-    for t, d, s in zip(texts, dense, sparse):
-        result.append({
-            "text": t,
-            "dense": d.tolist(),
-            "sparse": {k: float(v) for k, v in s.items()}
-        })
-    return result
+async def _ndjson(chunks, ocr_cache: OcrCache = None, key: str = None):
+    results = []
+    async for chunk in chunks:
+        results.append(chunk)
+        yield json.dumps(chunk, ensure_ascii=False) + "\n"
+    if ocr_cache is not None and key is not None:
+        await asyncio.to_thread(ocr_cache.put, key, _merge_chunks(results))
 
 
-def _rerank(reranker_model, p):
-    return reranker_model.compute_score(p, normalize=True)
+def _embedding(embedding_model, texts):
+    return encode_by_length(embedding_model, texts,
+                            max_length=config.embedding['max_length'],
+                            batch_size=config.embedding['batch_size'],
+                            max_batch_tokens=config.embedding['max_batch_tokens'])
+
+
+def _rerank(reranker_model, pairs):
+    # 按字符长度分桶，同一批内长度相近，减少 padding
+    scores = [0.0] * len(pairs)
+    lengths = [len(q) + len(p) for q, p in pairs]
+    for bucket in length_buckets(lengths, config.rerank['batch_size'], config.rerank['max_batch_length']):
+        bucket_scores = reranker_model.compute_score([pairs[i] for i in bucket],
+                                                     batch_size=len(bucket),
+                                                     max_length=config.rerank['max_length'],
+                                                     normalize=True)
+        if not isinstance(bucket_scores, list):
+            bucket_scores = [bucket_scores]
+        for i, score in zip(bucket, bucket_scores):
+            scores[i] = score
+    return scores
 
 
 from concurrent.futures import ThreadPoolExecutor
@@ -124,21 +350,73 @@ from concurrent.futures import ThreadPoolExecutor
 thread_executor = ThreadPoolExecutor(max_workers=24)
 
 
+class EmbeddingRequest(BaseModel):
+    texts: list[str]
+    # 需要返回的向量，可以整体指定，也可以按文本逐个指定
+    return_dense: Union[bool, list[bool]] = True
+    return_sparse: Union[bool, list[bool]] = True
+    # json 或 binary，binary 的编码格式见 codec.encode_embeddings
+    format: Literal["json", "binary"] = "json"
+    dense_dtype: Literal["float32", "float16"] = "float32"
+
+    @model_validator(mode="after")
+    def _check_flags(self):
+        """逐个指定时长度必须与 texts 一致，在入队前返回 422"""
+        for name in ("return_dense", "return_sparse"):
+            flag = getattr(self, name)
+            if isinstance(flag, list) and len(flag) != len(self.texts):
+                raise ValueError(f"{name} 长度 {len(flag)} 与 texts 长度 {len(self.texts)} 不一致")
+        return self
+
+
+def _flags(flag: Union[bool, list[bool]], length: int) -> list[bool]:
+    return flag if isinstance(flag, list) else [flag] * length
+
+
+Priority = Literal["interactive", "batch"]
+
+
 @app.post("/embedding")
-async def embedding(texts: list[str]):
+async def embedding(body: Union[list[str], EmbeddingRequest], request: Request, priority: Priority = "interactive"):
+    """priority: interactive 为查询请求，优先调度；batch 为入库等批量请求"""
+    legacy = isinstance(body, list)
+    if legacy:
+        body = EmbeddingRequest(texts=body)
+    texts = body.texts
     if texts is None or len(texts) == 0:
         return None
 
-    return await asyncio.get_event_loop().run_in_executor(thread_executor, _embedding,
-                                                          flag_embedding_model_manager.embedding_model,
-                                                          texts)
+    result = await request.app.state.embedding_batcher.submit(texts, priority)
+    dense_flags = _flags(body.return_dense, len(texts))
+    sparse_flags = _flags(body.return_sparse, len(texts))
+    if body.format == "binary":
+        return Response(content=encode_embeddings(result, dense_flags, sparse_flags, body.dense_dtype),
+                        media_type="application/octet-stream")
+
+    response = []
+    for t, r, dense, sparse in zip(texts, result, dense_flags, sparse_flags):
+        item = {"text": t} if legacy else {}
+        if dense:
+            item['dense'] = r['dense'].astype(body.dense_dtype).tolist()
+        if sparse:
+            item['sparse'] = {k: float(v) for k, v in r['sparse'].items()}
+        response.append(item)
+    return response
 
 
 @app.post("/rerank")
-async def rerank(pairs: list[list]):
-    return await asyncio.get_event_loop().run_in_executor(thread_executor, _rerank,
-                                                          flag_embedding_model_manager.rerank_model,
-                                                          pairs)
+async def rerank(pairs: list[tuple[str, str]], request: Request, priority: Priority = "interactive"):
+    """pairs 在入队前校验为 [query, passage] 字符串对，格式错误的请求直接返回 422，不影响同批其他请求"""
+    return await request.app.state.rerank_batcher.submit([list(pair) for pair in pairs], priority)
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    return {
+        "embedding": request.app.state.embedding_batcher.stats(),
+        "rerank": request.app.state.rerank_batcher.stats(),
+        "ocr_cache": request.app.state.ocr_cache.stats() if request.app.state.ocr_cache is not None else None,
+    }
 
 
 if __name__ == '__main__':
@@ -2,17 +2,59 @@ import torch
 from FlagEmbedding import FlagAutoModel
 from FlagEmbedding import FlagReranker
 
+from batcher import length_buckets
+
+
+def _quantize(model: torch.nn.Module) -> torch.nn.Module:
+    """CPU 动态量化，Linear 层权重转为 int8"""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def encode_by_length(embedding_model, texts: list[str], max_length: int = 8192, batch_size: int = 32,
+                     max_batch_tokens: int = 0) -> list[dict]:
+    """
+    按 token 长度分桶编码，返回与 texts 顺序一致的 [{"dense", "sparse"}]
+    桶内长度相近，减少 padding；每桶最多 batch_size 条，且 桶内最大长度 * 条数 不超过 max_batch_tokens，
+    长文本所在的桶条数更少，单个超长文本不会把整批 padding 到最大长度
+    """
+    tokenized = embedding_model.tokenizer(texts, truncation=True, max_length=max_length)
+    lengths = [len(ids) for ids in tokenized['input_ids']]
+    result = [None] * len(texts)
+    for bucket in length_buckets(lengths, batch_size, max_batch_tokens):
+        embeddings = embedding_model.encode([texts[i] for i in bucket], batch_size=len(bucket),
+                                            max_length=max(lengths[i] for i in bucket), return_sparse=True)
+        for i, dense, sparse in zip(bucket, embeddings['dense_vecs'], embeddings['lexical_weights']):
+            result[i] = {"dense": dense, "sparse": sparse}
+    return result
+
 
 class FlagEmbeddingModelManager:
+    """
+    backend:
+    torch: 原始 pytorch 模型，GPU 上使用 fp16
+    int8: CPU 动态量化模型，仅支持 cpu，密集、稀疏向量和重排使用同一个量化后的模型
+    """
+
     def __init__(self):
         self.embedding_model = None
         self.rerank_model = None
 
-    def load_embedding_model(self, model_path="BAAI/bge-m3", device="cuda" if torch.cuda.is_available() else "cpu"):
+    def load_embedding_model(self, model_path="BAAI/bge-m3", device="cuda" if torch.cuda.is_available() else "cpu",
+                             backend="torch"):
+        if backend == "int8":
+            self.embedding_model = FlagAutoModel.from_finetuned(model_path, use_fp16=False, devices="cpu")
+            # model 包含编码器以及 dense/sparse/colbert 输出层，一起量化
+            self.embedding_model.model = _quantize(self.embedding_model.model)
+            return
         self.embedding_model = FlagAutoModel.from_finetuned(model_path, use_fp16=True, devices=device)
 
     def load_rerank_model(self, model_path="BAAI/bge-reranker-v2-m3",
-                          device="cuda" if torch.cuda.is_available() else "cpu"):
+                          device="cuda" if torch.cuda.is_available() else "cpu",
+                          backend="torch"):
+        if backend == "int8":
+            self.rerank_model = FlagReranker(model_path, devices="cpu", use_fp16=False)
+            self.rerank_model.model = _quantize(self.rerank_model.model)
+            return
         self.rerank_model = FlagReranker(model_path, devices=device, use_fp16=True)
 
 
@@ -11,6 +11,7 @@ class SuryaModel:
             "use_llm": False
         }
         self.config_parser = ConfigParser(config)
+        self.config = self.config_parser.generate_config_dict()
         self.models = {}
 
     def load_model(self, device, dtype, pid):
@@ -21,6 +22,18 @@ class SuryaModel:
             config=self.config_parser.generate_config_dict(),
         )
 
+    def convert(self, pid, source, page_range: list[int] = None, extract_images: bool = True):
+        """
+        转换文档
+        page_range: 只转换这些页(从0开始)，None 为全部页
+        extract_images: 是否提取文档中的图片
+        """
+        converter = self.models[pid]
+        converter.config = {**self.config, "extract_images": extract_images}
+        if page_range:
+            converter.config["page_range"] = page_range
+        return converter(source)
+
 
 suryaModel = SuryaModel()
 
@@ -0,0 +1,93 @@
+"""
+文档切分性能测试
+
+python benchmark.py splitter --size-mb 4
+    在模拟的多 MB OCR 文本上对比旧的按句切分(re.split + text.index)与单次扫描切分的耗时，
+    并校验新的切分结果拼接后与原文一致、起始位置准确
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+from src.core.components.rag_spliter import RAGSplitter
+
+WORDS = ["知识库", "向量检索", "重排模型", "工业革命", "碳排放", "能源转型", "文档解析", "表格", "大模型",
+         "retrieval", "embedding", "reranker", "document", "pipeline", "latency", "throughput", "index"]
+DELIMITERS = ["，", "。", ",", ".", "。。", ", "]
+
+
+def make_ocr_text(size: int, seed: int = 0) -> str:
+    """生成约 size 个字符的文本，包含重复出现的页眉页脚句子"""
+    rng = random.Random(seed)
+    header = "第一章 总则。"
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.02:
+            sentence = header
+        else:
+            sentence = "".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))) + rng.choice(DELIMITERS)
+        if rng.random() < 0.05:
+            sentence += "\n\f"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def legacy_sentence_units(text: str, max_length: int = 1024) -> list[str]:
+    """旧实现，每个片段都从头 text.index 查找位置"""
+    units = []
+    for r in re.split(r'[,，.。]+', text):
+        if r == '':
+            continue
+        index = text.index(r)
+        if index + len(r) >= len(text):
+            units.append(r)
+            break
+        unit = r + text[index + len(r)]
+        if len(unit) > max_length:
+            units.extend(unit[i:i + max_length] for i in range(0, len(unit), max_length))
+            continue
+        units.append(unit)
+    return units
+
+
+def splitter_benchmark(args) -> bool:
+    text = make_ocr_text(int(args.size_mb * 1024 * 1024))
+    splitter = RAGSplitter(split_by="sentence", split_length=20, split_overlap=4, split_threshold=10)
+
+    start = time.perf_counter()
+    units, starts = splitter._split_into_units(text, "sentence")
+    elapsed = time.perf_counter() - start
+    print(f"text {len(text)} chars, {len(units)} units")
+    print(f"single pass {elapsed:8.3f} s")
+
+    if not args.skip_legacy:
+        start = time.perf_counter()
+        legacy_units = legacy_sentence_units(text)
+        legacy_elapsed = time.perf_counter() - start
+        print(f"legacy      {legacy_elapsed:8.3f} s ({len(legacy_units)} units), "
+              f"speedup {legacy_elapsed / max(elapsed, 1e-9):.1f}x")
+
+    return "".join(units) == text and all(text.startswith(u, s) for u, s in zip(units, starts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    splitter = sub.add_parser("splitter", help="按句切分耗时对比")
+    splitter.add_argument("--size-mb", type=float, default=4)
+    splitter.add_argument("--skip-legacy", action="store_true", help="不运行旧实现，旧实现在大文本上非常慢")
+    splitter.set_defaults(func=splitter_benchmark)
+
+    args = parser.parse_args()
+    if not args.func(args):
+        print("offset check failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
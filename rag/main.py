@@ -10,6 +10,7 @@ from server.entity import KnowledgeModel
 from src.core.components.milvus_manager import MilvusManager
 from src.core.config import config
 from src.core.router.rag_base_router import router as rag_router
+from src.core.util.inference_client import inference_client
 from src.core.util.mcp_util import MCPManager
 from src.server.core.exceptions import exception_handlers
 from src.server.core.middleware import middlewares
@@ -45,6 +46,7 @@ async def startup_event():
         timezone="Asia/Shanghai",
     )
     await Tortoise.generate_schemas()
+    await inference_client.start()
 
     collection_names = [col.index_name for col in await KnowledgeModel.all().order_by('-created')]
     client = AsyncMilvusClient(uri=f"http://{config.milvus['host']}:{config.milvus['port']}",
@@ -60,10 +62,12 @@ async def startup_event():
     app.state.analysis_task = task
     app.state.async_milvus_client = client
     app.state.milvus_manager = milvus_manager
+    app.state.inference_client = inference_client
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await inference_client.close()
     await Tortoise.close_connections()
 
 
@@ -1,12 +1,16 @@
 import asyncio
+import inspect
+from typing import Any, AsyncIterator, Callable, Optional
 
+from haystack import Document
 from tortoise import Tortoise
 
 from src.core.components.embedding import FlagEmbedding
 from src.core.components.milvus_manager import MilvusManager
 from src.core.components.spliter import Spliter
+from src.core.config import config
 from src.core.util import io_util
-from src.server.entity import KnowledgeModel, KnowledgeDocumentModel
+from src.server.entity import KnowledgeModel, KnowledgeDocumentModel, IngestionJobModel
 
 
 class VectorTask:
@@ -42,9 +46,49 @@ class VectorTask:
         self.split_overlap = split_overlap
 
 
+# 入库任务阶段，见 IngestionJobModel.stage
+QUEUED, PARSED, SPLIT, DONE = 0, 1, 2, 3
+
+
+class IngestionJob:
+    """
+    一个文档在入库流水线中的状态，依次经过 解析 -> 切分 -> 嵌入 -> 写入
+    每个阶段完成后保存到 IngestionJobModel，重启后跳过已完成的阶段
+    """
+
+    def __init__(self, vector_task: VectorTask, record: IngestionJobModel):
+        self.vector_task = vector_task
+        self.record = record
+        self.spliter = Spliter(collection_name=vector_task.collection_name)
+        self.spliter.file_name = vector_task.file_name
+        # 从检查点恢复的任务，写入前先清理上次可能已写入、但未记录的数据
+        self.resumed = record.stage > QUEUED or record.inserted > 0
+        # 解析结果(未切分)
+        self.documents = [Document.from_dict(d) for d in record.documents or []]
+        # 切分结果
+        self.chunks = [Document.from_dict(d) for d in record.chunks or []]
+        # 已写入 milvus 的批次起始位置，record.inserted 只推进到连续写入的位置
+        self.inserted_offsets = set()
+        self.lock = asyncio.Lock()
+        self.failed = False
+
+
+class EmbeddedBatch:
+    """一批已嵌入、待写入 milvus 的分块，offset 为该批第一个分块在 job.chunks 中的位置"""
+
+    def __init__(self, job: IngestionJob, offset: int, rows: list[dict]):
+        self.job = job
+        self.vector_task = job.vector_task
+        self.offset = offset
+        self.rows = rows
+
+
 class AnalysisTask:
     """
     用于管理解析任务的类
+    解析、切分、嵌入、写入 四个阶段各自有若干 worker，阶段之间通过有界队列连接，
+    下游处理不过来时上游阻塞等待(背压)，不同文档在各阶段并行处理
+    任务和各阶段的结果保存在 IngestionJobModel 中，服务重启后从最后完成的阶段继续
     """
 
     def __init__(self, milvus_manager: MilvusManager):
@@ -52,58 +96,251 @@ class AnalysisTask:
             raise ValueError("milvus_manager cannot be None")
         self.milvus_manager = milvus_manager
         self.vector_task_queue = asyncio.Queue()
+        self.split_queue = asyncio.Queue(maxsize=config.analysis["queue_size"])
+        self.embed_queue = asyncio.Queue(maxsize=config.analysis["queue_size"])
+        self.insert_queue = asyncio.Queue(maxsize=config.analysis["queue_size"])
+        # 排队或处理中的文档 (k_id, d_id)，同一文档同时只有一个任务
+        self._in_flight: set[tuple[int, int]] = set()
 
-    async def add_vector_task(self, vector_tasks: [VectorTask]):
+    @staticmethod
+    def _key(vector_task: VectorTask) -> tuple[int, int]:
+        return vector_task.k_id, vector_task.d_id
+
+    def _reserve(self, vector_task: VectorTask) -> bool:
+        """占用文档的任务名额，同一文档已在排队或处理中时返回 False；在任何 await 之前调用，避免并发请求同时通过检查"""
+        key = self._key(vector_task)
+        if key in self._in_flight:
+            print(f"文档已在解析队列中，跳过: {vector_task.file_name}")
+            return False
+        self._in_flight.add(key)
+        return True
+
+    def _enqueue(self, vector_task: VectorTask) -> bool:
+        """入队，同一文档已在排队或处理中时跳过"""
+        if not self._reserve(vector_task):
+            return False
+        self.vector_task_queue.put_nowait(vector_task)
+        return True
+
+    def _release(self, vector_task: VectorTask):
+        """文档的任务结束(完成、失败或文档已删除)，允许再次入队"""
+        self._in_flight.discard(self._key(vector_task))
+
+    async def add_vector_task(self, vector_tasks: [VectorTask]) -> list[tuple[int, int]]:
+        """
+        新的解析任务，之前的进度和已写入 milvus 的数据作废，从头开始
+        文档已在排队或处理中时跳过，不重置正在使用的入库记录
+        返回被跳过的文档 (k_id, d_id)
+        """
+        skipped = []
         for vector_task in vector_tasks:
+            if not self._reserve(vector_task):
+                skipped.append(self._key(vector_task))
+                continue
+            try:
+                record = await IngestionJobModel.filter(k_id=vector_task.k_id, d_id=vector_task.d_id).get_or_none()
+                if record is not None:
+                    await self._discard_inserted(record)
+                await IngestionJobModel.update_or_create(
+                    k_id=vector_task.k_id, d_id=vector_task.d_id,
+                    defaults={
+                        "collection_name": vector_task.collection_name,
+                        "file_path": vector_task.file_path,
+                        "file_name": vector_task.file_name,
+                        "mime_type": vector_task.mimetype,
+                        "split_length": vector_task.split_length,
+                        "split_overlap": vector_task.split_overlap,
+                        "stage": QUEUED,
+                        "documents": None,
+                        "chunks": None,
+                        "inserted": 0,
+                        "inserted_ids": None,
+                    })
+            except BaseException:
+                self._release(vector_task)
+                raise
             self.vector_task_queue.put_nowait(vector_task)
+        return skipped
+
+    @staticmethod
+    async def _exists(vector_task: VectorTask) -> bool:
+        """查询数据库，如果查不到这个知识库中的这个文档，就代表已经被删除，就不再执行解析任务"""
+        knowledge_doc = await KnowledgeDocumentModel.filter(k_id=vector_task.k_id,
+                                                            d_id=vector_task.d_id).get_or_none()
+        if knowledge_doc is None:
+            await IngestionJobModel.filter(k_id=vector_task.k_id, d_id=vector_task.d_id).delete()
+        return knowledge_doc is not None
+
+    async def parse(self, vector_task: VectorTask) -> Optional[IngestionJob]:
+        if not await self._exists(vector_task):
+            self._release(vector_task)
+            return None
+        await KnowledgeDocumentModel.filter(k_id=vector_task.k_id, d_id=vector_task.d_id).update(
+            status_text=f"解析中", status_code=1)
 
-    async def analysis(self, vector_task: VectorTask):
-        file_path = vector_task.file_path
-        d_id = vector_task.d_id
-        k_id = vector_task.k_id
-        file_name = vector_task.file_name
-        collection_name = vector_task.collection_name
-
-        try:
-            # 查询数据库，如果查不到这个知识库中的这个文档，就代表已经被删除，就不再执行解析任务
-            knowledge_doc = await KnowledgeDocumentModel.filter(k_id=k_id, d_id=d_id).get_or_none()
-            if knowledge_doc is None:
+        record, _ = await IngestionJobModel.get_or_create(
+            k_id=vector_task.k_id, d_id=vector_task.d_id,
+            defaults={
+                "collection_name": vector_task.collection_name,
+                "file_path": vector_task.file_path,
+                "file_name": vector_task.file_name,
+                "mime_type": vector_task.mimetype,
+                "split_length": vector_task.split_length,
+                "split_overlap": vector_task.split_overlap,
+            })
+        if record.stage == DONE:
+            # 已完成的任务重新解析，删除上次写入的数据后从头开始
+            await self._discard_inserted(record)
+            record.stage, record.inserted, record.inserted_ids = QUEUED, 0, None
+        job = IngestionJob(vector_task, record)
+        if record.stage >= PARSED:
+            return job
+
+        job.documents = await job.spliter.parse(data=await io_util.get_file(vector_task.file_path),
+                                                mime_type=vector_task.mimetype,
+                                                file_name=vector_task.file_name)
+        record.documents = [d.to_dict(flatten=False) for d in job.documents]
+        record.stage = PARSED
+        await record.save(update_fields=["documents", "stage", "inserted", "inserted_ids"])
+        return job
+
+    async def split(self, job: IngestionJob) -> Optional[IngestionJob]:
+        record = job.record
+        if record.stage < SPLIT:
+            job.chunks = await job.spliter.split(job.documents,
+                                                 split_length=job.vector_task.split_length,
+                                                 split_overlap=job.vector_task.split_overlap)
+            record.chunks = [d.to_dict(flatten=False) for d in job.chunks]
+            # 切分结果已保存，不再需要解析结果
+            record.documents = None
+            record.stage = SPLIT
+            await record.save(update_fields=["chunks", "documents", "stage"])
+        job.documents = []
+        return job
+
+    async def embed(self, job: IngestionJob) -> AsyncIterator[EmbeddedBatch]:
+        """按 embed_batch_size 分批嵌入，每批完成后立即交给写入阶段，内存只保留队列中的几批"""
+        # 在执行嵌入模型前再次检查文档是否存在
+        if not await self._exists(job.vector_task):
+            self._release(job.vector_task)
+            return
+        # 通过 k_id 查询知识库类型
+        knowledge_base = await KnowledgeModel.filter(id=job.vector_task.k_id).get_or_none()
+        if knowledge_base is None:
+            self._release(job.vector_task)
+            return
+
+        print(f"************** start embedding documents: {job.vector_task.file_name} **************")
+        start = job.record.inserted
+        if job.resumed:
+            await self._delete_uncommitted(job, job.chunks[start:])
+        if start >= len(job.chunks):
+            # 已全部写入，只剩更新状态
+            yield EmbeddedBatch(job, start, [])
+            return
+
+        embedder = FlagEmbedding()
+        batch_size = config.analysis["embed_batch_size"]
+        # 已写入的分块不再重复嵌入
+        for offset in range(start, len(job.chunks), batch_size):
+            if job.failed:
                 return
+            rows = await embedder.embedding_documents(job.chunks[offset:offset + batch_size])
+            yield EmbeddedBatch(job, offset, rows)
 
-            await KnowledgeDocumentModel.filter(k_id=k_id, d_id=d_id).update(
-                status_text=f"解析中", status_code=1)
-
-            spliter = Spliter(collection_name=collection_name)
-            docs = await spliter.run(data=await io_util.get_file(file_path),
-                                     mime_type=vector_task.mimetype,
-                                     file_name=file_name,
-                                     split_length=vector_task.split_length,
-                                     split_overlap=vector_task.split_overlap)
-            # 在执行嵌入模型前再次检查文档是否存在
-            knowledge_doc = await KnowledgeDocumentModel.filter(k_id=k_id, d_id=d_id).get_or_none()
-            if knowledge_doc is None:
+    async def insert(self, batch: EmbeddedBatch) -> None:
+        job = batch.job
+        if job.failed:
+            return
+        vector_task = job.vector_task
+        record = job.record
+        ids = []
+        if len(batch.rows) > 0:
+            r = await self.milvus_manager.insert_data(collection_name=vector_task.collection_name,
+                                                      data=batch.rows)
+            ids = list(r['ids'])
+            if job.failed:
+                # 写入期间同一文档的其他批次失败，任务已结束，删除本批数据
+                await self.milvus_manager.delete_ids(vector_task.collection_name, ids)
                 return
 
-            # 通过 k_id 查询知识库类型
-            knowledge_base = await KnowledgeModel.filter(id=k_id).get_or_none()
-            if knowledge_base is None:
+        async with job.lock:
+            job.inserted_offsets.add(batch.offset)
+            batch_size = config.analysis["embed_batch_size"]
+            while record.inserted in job.inserted_offsets:
+                job.inserted_offsets.remove(record.inserted)
+                record.inserted = min(record.inserted + batch_size, len(job.chunks))
+            record.inserted_ids = (record.inserted_ids or []) + ids
+            await record.save(update_fields=["inserted", "inserted_ids"])
+
+            if record.inserted < len(job.chunks):
+                progress = int(record.inserted * 100 / len(job.chunks))
+                await KnowledgeDocumentModel.filter(k_id=vector_task.k_id, d_id=vector_task.d_id).update(
+                    status_text=f"解析中 {progress}%", status_code=1)
                 return
 
-            print("************** start embedding documents **************")
-            embedder = FlagEmbedding()
-            r = await embedder.embedding_documents(docs)
-            count = await self.milvus_manager.insert_data(collection_name=collection_name,
-                                                          data=r)
+            print(f"文档数量: {len(record.inserted_ids)}")
+            await KnowledgeDocumentModel.filter(k_id=vector_task.k_id, d_id=vector_task.d_id).update(
+                status_text=f"解析成功", status_code=3, source_id=job.chunks[0].meta['source_id'])
+
+            # 已完成的任务只保留进度，不再保留分块内容
+            record.stage = DONE
+            record.chunks = None
+            await record.save(update_fields=["stage", "chunks"])
+            self._release(vector_task)
+
+    async def _delete_uncommitted(self, job: IngestionJob, chunks: list[Document]):
+        """
+        上次写入 milvus 后、保存进度前中断时，这些分块可能已经写入，按 source_id + split_id 先删除再写入
+        """
+        split_ids = {}
+        for chunk in chunks:
+            split_ids.setdefault(chunk.meta['source_id'], []).append(chunk.meta['split_id'])
+        for source_id, ids in split_ids.items():
+            await self.milvus_manager.delete_splits(job.vector_task.collection_name, source_id, ids)
 
-            print(f"文档数量: {count['insert_count']}")
+    async def _discard_inserted(self, record: IngestionJobModel):
+        """删除入库记录上次已写入 milvus 的数据，包括已记录的主键和未记录进度的分块"""
+        await self.milvus_manager.delete_ids(record.collection_name, record.inserted_ids or [])
+        source_ids = list({chunk['meta']['source_id'] for chunk in record.chunks or []})
+        await self.milvus_manager.delete_sources(record.collection_name, source_ids)
 
-            await KnowledgeDocumentModel.filter(k_id=k_id, d_id=d_id).update(
-                status_text=f"解析成功", status_code=3, source_id=docs[0].meta['source_id'])
+    @staticmethod
+    async def _fail(vector_task: VectorTask, e: Exception):
+        print(f"解析任务出错: {e}")
+        print(f"解析失败----->{vector_task.file_name}")
+        await KnowledgeDocumentModel.filter(k_id=vector_task.k_id, d_id=vector_task.d_id).update(
+            status_text=f"服务器错误", status_code=2)
 
-        except Exception as e:
-            print(f"解析任务出错: {e}")
-            await KnowledgeDocumentModel.filter(k_id=k_id, d_id=d_id).update(
-                status_text=f"服务器错误", status_code=2)
+    async def _stage_worker(self, stage: Callable[[Any], Any], inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]):
+        """
+        阶段 worker：从 inbox 取任务执行 stage，结果放入 outbox，outbox 满时阻塞等待
+        stage 返回 None 表示文档已删除，不再继续；stage 为异步生成器时，每产出一项就放入 outbox
+        """
+        while True:
+            item = await inbox.get()
+            try:
+                if item is None:
+                    continue
+                job = item.job if isinstance(item, EmbeddedBatch) else item
+                try:
+                    if inspect.isasyncgenfunction(stage):
+                        async for result in stage(item):
+                            await outbox.put(result)
+                    else:
+                        result = await stage(item)
+                        if result is not None and outbox is not None:
+                            await outbox.put(result)
+                except Exception as e:
+                    if isinstance(job, IngestionJob):
+                        if job.failed:
+                            continue
+                        job.failed = True
+                    vector_task = item if isinstance(item, VectorTask) else item.vector_task
+                    self._release(vector_task)
+                    await self._fail(vector_task, e)
+            finally:
+                inbox.task_done()  # 标记任务已完成
 
     async def get_processing_task_status(self):
         """`
@@ -132,6 +369,8 @@ class AnalysisTask:
             status_code=d['status_code'],
             status_text=d['status_text'],
             source_id=d['source_id'],
+            split_length=d['split_length'],
+            split_overlap=d['split_overlap'],
         ) for d in docs]
         return result
 
@@ -139,19 +378,14 @@ class AnalysisTask:
         print("开启解析任务------------->>>>>>>>>>>>>>>>>>")
         tasks = await self.get_processing_task_status()
         for t in tasks:
-            await self.add_vector_task([t])
-        while True:
-            # 从队列中取出一条任务（阻塞直到有任务可用）
-            vector_task = await self.vector_task_queue.get()
-            if vector_task is None:
-                continue
-
-            try:
-                print(f"Executing task: {vector_task}")
-                await asyncio.sleep(5)
-                await self.analysis(vector_task)
-            except Exception as e:
-                print(e)
-                print(f"解析失败----->{vector_task.file_name}")
-            finally:
-                self.vector_task_queue.task_done()  # 标记任务已完成
+            # 未完成的任务直接入队，parse 读取已有的入库记录，从最后完成的阶段继续
+            self._enqueue(t)
+        stages = [
+            (self.parse, self.vector_task_queue, self.split_queue, config.analysis["parse_workers"]),
+            (self.split, self.split_queue, self.embed_queue, config.analysis["split_workers"]),
+            (self.embed, self.embed_queue, self.insert_queue, config.analysis["embed_workers"]),
+            (self.insert, self.insert_queue, None, config.analysis["insert_workers"]),
+        ]
+        await asyncio.gather(*[self._stage_worker(stage, inbox, outbox)
+                               for stage, inbox, outbox, workers in stages
+                               for _ in range(workers)])
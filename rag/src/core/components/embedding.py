@@ -1,10 +1,17 @@
+import struct
 from copy import deepcopy
-from typing import List
+from typing import List, Literal, Union
 
 import aiohttp
+import numpy as np
 from haystack import Document
 
 from src.core.config import config
+from src.core.util.embedding_cache import embedding_cache
+from src.core.util.inference_client import inference_client
+
+# 推理服务调度优先级：interactive 为查询请求，batch 为入库等批量请求
+Priority = Literal["interactive", "batch"]
 
 
 class FlagEmbedding:
@@ -18,28 +25,122 @@ class FlagEmbedding:
                     d[key] = value
                 del d['meta']
             _docs.append(d)
-        r = await self.embedding([d['content'] for d in _docs])
+        r = await self.cached_embedding([d['content'] for d in _docs], priority="batch")
         for d, j in zip(_docs, r):
             d['vector'] = j['dense']
             d['sparse_vector'] = j['sparse']
         return _docs
 
-    async def run(self, text: list[str]):
-        return await self.embedding(text)
-
-    async def embedding(self, texts: list[str]):
-        host = config.interface["inference"]
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(f"{host}/embedding",
-                                        timeout=-1,
-                                        json=texts,
-                                        headers={"Content-Type": "application/json"},
-                                        ) as response:
-                    response.raise_for_status()  # 检查 HTTP 错误
-                    data = await response.json()
-                    return data
-            except aiohttp.ClientError as e:
-                return {"error": f"HTTP error occurred: {str(e)}"}
-            except Exception as e:
-                return {"error": f"An error occurred: {str(e)}"}
+    async def run(self, text: list[str], return_dense: Union[bool, list[bool]] = True,
+                  return_sparse: Union[bool, list[bool]] = True, priority: Priority = "interactive"):
+        """
+        return_dense / return_sparse: 需要返回的向量，可以整体指定，也可以按文本逐个指定，
+        不同文本需要不同向量时也只需一次请求
+        priority: 推理服务调度优先级，查询用 interactive，入库用 batch
+        """
+        return await self.cached_embedding(text, return_dense, return_sparse, priority)
+
+    async def cached_embedding(self, texts: list[str], return_dense: Union[bool, list[bool]] = True,
+                               return_sparse: Union[bool, list[bool]] = True, priority: Priority = "interactive"):
+        """先查嵌入缓存，只有未命中的文本才请求推理服务"""
+        if embedding_cache is None:
+            return await self.embedding(texts, return_dense, return_sparse, priority)
+
+        dense_flags = _flags(return_dense, len(texts))
+        sparse_flags = _flags(return_sparse, len(texts))
+        cached = await embedding_cache.get_many(texts)
+        # 同一批次中重复的文本只请求一次
+        need = {}
+        for t, dense, sparse in zip(texts, dense_flags, sparse_flags):
+            if t in cached:
+                continue
+            flags = need.setdefault(t, [False, False])
+            flags[0] = flags[0] or dense
+            flags[1] = flags[1] or sparse
+        if len(need) > 0:
+            missing = list(need)
+            r = await self.embedding(missing, [need[t][0] for t in missing], [need[t][1] for t in missing],
+                                     priority)
+            if isinstance(r, dict):
+                return r
+            fetched = dict(zip(missing, r))
+            # 只缓存同时包含密集和稀疏向量的结果
+            await embedding_cache.put_many({t: j for t, j in fetched.items() if 'dense' in j and 'sparse' in j})
+            cached.update(fetched)
+
+        result = []
+        for t, dense, sparse in zip(texts, dense_flags, sparse_flags):
+            item = {"text": t}
+            if dense:
+                item['dense'] = cached[t]['dense']
+            if sparse:
+                item['sparse'] = cached[t]['sparse']
+            result.append(item)
+        return result
+
+    async def embedding(self, texts: list[str], return_dense: Union[bool, list[bool]] = True,
+                        return_sparse: Union[bool, list[bool]] = True, priority: Priority = "interactive"):
+        try:
+            wire_format = config.interface.get("embedding_format", "binary")
+            async with inference_client.post("embedding",
+                                             json={
+                                                 "texts": texts,
+                                                 "return_dense": return_dense,
+                                                 "return_sparse": return_sparse,
+                                                 "format": wire_format,
+                                                 "dense_dtype": config.interface.get("embedding_dense_dtype",
+                                                                                     "float32"),
+                                             },
+                                             headers={"Content-Type": "application/json"},
+                                             params={"priority": priority},
+                                             ) as response:
+                if wire_format == "binary":
+                    return decode_embeddings(await response.read())
+                data = await response.json()
+                return data
+        except aiohttp.ClientError as e:
+            return {"error": f"HTTP error occurred: {str(e)}"}
+        except Exception as e:
+            return {"error": f"An error occurred: {str(e)}"}
+
+
+def decode_embeddings(buffer: bytes) -> list[dict]:
+    """
+    解码推理服务 binary 格式的嵌入结果，格式见推理服务 codec.encode_embeddings
+    float32 密集向量直接是响应数据上的 numpy 视图，不复制；float16 会转换为 float32
+    """
+    magic, n, dim, dtype = struct.unpack_from("<4sIIB3x", buffer, 0)
+    if magic != b"EMB1":
+        raise ValueError("embedding 响应格式错误")
+    offset = 16
+    flags = np.frombuffer(buffer, dtype=np.uint8, count=n, offset=offset)
+    offset += n + (-n % 4)
+
+    result = [{} for _ in range(n)]
+    dense_index = np.flatnonzero(flags & 1)
+    if len(dense_index) > 0:
+        dense = np.frombuffer(buffer, dtype="<f4" if dtype == 1 else "<f2", count=len(dense_index) * dim,
+                              offset=offset).reshape(len(dense_index), dim)
+        offset += dense.nbytes + (-dense.nbytes % 4)
+        if dense.dtype != np.float32:
+            # milvus 密集向量字段为 float32
+            dense = dense.astype(np.float32)
+        for i, row in zip(dense_index, dense):
+            result[i]['dense'] = row
+
+    sparse_index = np.flatnonzero(flags & 2)
+    if len(sparse_index) > 0:
+        offsets = np.frombuffer(buffer, dtype="<u4", count=len(sparse_index) + 1, offset=offset)
+        offset += offsets.nbytes
+        total = int(offsets[-1])
+        indices = np.frombuffer(buffer, dtype="<i4", count=total, offset=offset)
+        offset += indices.nbytes
+        values = np.frombuffer(buffer, dtype="<f4", count=total, offset=offset)
+        for k, i in enumerate(sparse_index):
+            start, end = offsets[k], offsets[k + 1]
+            result[i]['sparse'] = dict(zip(indices[start:end].tolist(), values[start:end].tolist()))
+    return result
+
+
+def _flags(flag: Union[bool, list[bool]], length: int) -> list[bool]:
+    return flag if isinstance(flag, list) else [flag] * length
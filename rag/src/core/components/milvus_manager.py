@@ -59,6 +59,21 @@ class MilvusManager:
                                            in data])
         return r
 
+    async def delete_splits(self, collection_name: str, source_id: str, split_ids: list[int]):
+        """删除某个源文档的指定分块，用于断点续传时重新写入前清理可能已写入的数据"""
+        await self.client.delete(collection_name=collection_name,
+                                 filter=f"source_id == '{source_id}' and split_id in {split_ids}")
+
+    async def delete_ids(self, collection_name: str, ids: list[int]):
+        """按主键删除，用于重新解析前删除上次入库写入的数据"""
+        if len(ids) > 0:
+            await self.client.delete(collection_name=collection_name, ids=ids)
+
+    async def delete_sources(self, collection_name: str, source_ids: list[str]):
+        """删除源文档的全部分块"""
+        if len(source_ids) > 0:
+            await self.client.delete(collection_name=collection_name, filter=f"source_id in {source_ids}")
+
     @staticmethod
     def get_field_schema(dim: int = 1024):
         index = IndexParams()
@@ -1,3 +1,5 @@
+import asyncio
+import json
 import logging
 from pathlib import Path
 from typing import List, Union, Optional, Dict, Any
@@ -7,7 +9,9 @@ from haystack import component, Document
 from haystack.components.converters.utils import normalize_metadata
 from haystack.dataclasses import ByteStream
 
+from src.core.components import text_layer
 from src.core.config import config
+from src.core.util.inference_client import inference_client
 
 logger = logging.getLogger(__name__)
 
@@ -32,14 +36,85 @@ class Multimodal2Document:
         documents = []
         meta_list = normalize_metadata(meta, sources_count=len(sources))
         for source, metadata in zip(sources, meta_list):
-            json = await self.convert_pdf(source.data, source.meta['file_name'], source.mime_type)
-            text = json['text']
-            document = Document(content=text, meta={"file_path": ""})
+            text, extraction = await self.convert(source.data, source.meta['file_name'], source.mime_type)
+            # extraction 随 meta 复制到每个分块，保存在入库记录中
+            document = Document(content=text, meta={"file_path": "", "extraction": extraction})
             documents.append(document)
         return {"documents": documents}
 
-    async def convert_pdf(self, file_bytes: list[bytes], file_name, content_type) -> dict:
-        host = config.interface["inference"]
+    async def convert(self, file_bytes: bytes, file_name, content_type) -> tuple[str, dict]:
+        """
+        有可用文字层的 pdf/docx/pptx 直接在本地提取，pdf 只有文字层不可用的页才送去 OCR
+        返回 (文本, 提取方式)，提取方式中 pages 记录 pdf 每页使用的是 text 还是 ocr
+        """
+        if config.text_layer["enable"]:
+            try:
+                if content_type == text_layer.PDF:
+                    return await self._convert_pdf_pages(file_bytes, file_name, content_type)
+                if content_type == text_layer.DOCX:
+                    text = await asyncio.to_thread(text_layer.extract_docx, file_bytes)
+                elif content_type == text_layer.PPTX:
+                    text = await asyncio.to_thread(text_layer.extract_pptx, file_bytes)
+                else:
+                    text = None
+                if text is not None:
+                    return text, {"method": "text"}
+            except Exception as e:
+                logger.warning(f"文字层提取失败，使用OCR，file_name:{file_name},error info:{e}")
+
+        result = await self.convert_pdf(file_bytes, file_name, content_type)
+        return result['text'], {"method": "ocr"}
+
+    async def _convert_pdf_pages(self, file_bytes: bytes, file_name, content_type) -> tuple[str, dict]:
+        pages = await asyncio.to_thread(text_layer.extract_pdf_pages, file_bytes)
+        methods = ["text" if page is not None else "ocr" for page in pages]
+        ocr_pages = [i for i, page in enumerate(pages) if page is None]
+        if len(ocr_pages) == len(pages):
+            result = await self.convert_pdf(file_bytes, file_name, content_type)
+            return result['text'], {"method": "ocr", "pages": methods}
+
+        ocr_texts = {}
+        if len(ocr_pages) > 0:
+            # 连续的需要 OCR 的页合并为页段，所有页段在一次请求中识别，pdf 只上传一次
+            runs = []
+            for i in ocr_pages:
+                if len(runs) > 0 and runs[-1][1] == i - 1:
+                    runs[-1][1] = i
+                else:
+                    runs.append([i, i])
+            page_range = ",".join(f"{start}-{end}" for start, end in runs)
+            # 返回的每段 pages 为连续页，文本放在该段第一页的位置；命中缓存时 pages 为空，整体放在第一个 OCR 页
+            async for chunk in self.convert_pdf_stream(file_bytes, file_name, content_type, page_range):
+                first = chunk['pages'][0] if chunk['pages'] else ocr_pages[0]
+                ocr_texts[first] = "\n\n".join(text for text in [ocr_texts.get(first), chunk['text']] if text)
+
+        blocks = []
+        for i, page in enumerate(pages):
+            if page is not None:
+                blocks.append(page)
+            elif i in ocr_texts:
+                blocks.append(ocr_texts[i])
+        method = "text" if len(ocr_pages) == 0 else "mixed"
+        return "\n\n".join(block for block in blocks if block), {"method": method, "pages": methods}
+
+    async def convert_pdf(self, file_bytes: list[bytes], file_name, content_type, page_range: str = None) -> dict:
+        """
+        page_range: 只识别 pdf 的这些页，如 "0-3,5"，页码从0开始
+        """
+        try:
+            texts = [chunk['text'] async for chunk in self.convert_pdf_stream(file_bytes, file_name, content_type,
+                                                                              page_range)]
+            return {"text": "\n\n".join(text for text in texts if text)}
+        except aiohttp.ClientError as e:
+            return {"error": f"HTTP error occurred: {str(e)}"}
+        except Exception as e:
+            return {"error": f"An error occurred: {str(e)}"}
+
+    async def convert_pdf_stream(self, file_bytes: bytes, file_name, content_type, page_range: str = None):
+        """
+        流式识别，按页顺序逐段返回 {"pages": [...], "text": ...}，每个页段识别完成即可使用
+        入库只用文本，不请求图片
+        """
         data = aiohttp.FormData()
         data.add_field(
             "file",
@@ -47,16 +122,18 @@ class Multimodal2Document:
             filename=file_name,
             content_type=content_type
         )
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(f"{host}/ocr",
-                                        timeout=None,
-                                        data=data,
-                                        ) as response:
-                    response.raise_for_status()  # 检查 HTTP 错误
-                    data = await response.json()
-                    return data
-            except aiohttp.ClientError as e:
-                return {"error": f"HTTP error occurred: {str(e)}"}
-            except Exception as e:
-                return {"error": f"An error occurred: {str(e)}"}
+        if page_range is not None:
+            data.add_field("page_range", page_range)
+        data.add_field("return_images", "false")
+        data.add_field("stream", "true")
+        async with inference_client.post("ocr", data=data) as response:
+            # 单行可能超过 StreamReader.readline 的长度限制，自行按换行切分
+            buffer = b""
+            async for chunk in response.content.iter_any():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
@@ -3,11 +3,15 @@
 # SPDX-License-Identifier: Apache-2.0
 import re
 from copy import deepcopy
-from typing import Dict, List, Literal, Tuple
+from typing import Dict, List, Literal, Optional, Tuple
 
 from haystack import Document, component
 from more_itertools import windowed
 
+from src.core.util.tokenizer import token_counter
+
+SENTENCE_DELIMITERS = r'[,，.。]+'
+
 
 @component
 class RAGSplitter:
@@ -51,6 +55,7 @@ class RAGSplitter:
             split_threshold: int = 0,
             file_name: str = '',
             split_at: str = '',
+            tokenizer: Optional[str] = None,
     ):
         """
         Initialize DocumentSplitter.
@@ -62,6 +67,8 @@ class RAGSplitter:
         :param split_overlap: The number of overlapping units for each split.
         :param split_threshold: The minimum number of units per split. If a split has fewer units
             than the threshold, it's attached to the previous split.
+        :param tokenizer: 仅 token 模式使用，分词器名称，默认为配置 splitter.tokenizer。
+            token 模式下 split_length / split_overlap 为每块最多 token 数 / 相邻块重叠 token 数
         """
 
         self.split_by = split_by
@@ -77,6 +84,7 @@ class RAGSplitter:
         self.file_name = file_name
         if split_by == 'custom':
             self.split_at = split_at
+        self.tokenizer = tokenizer
 
     @component.output_types(documents=List[Document])
     def run(self, documents: List[Document]):
@@ -107,10 +115,13 @@ class RAGSplitter:
                 raise ValueError(
                     f"DocumentSplitter only works with text documents but content for document ID {doc.id} is None."
                 )
-            units = self._split_into_units(doc.content, self.split_by)
-            text_splits, splits_pages, splits_start_idxs = self._concatenate_units(
-                units, self.split_length, self.split_overlap, self.split_threshold
-            )
+            if self.split_by == "token":
+                text_splits, splits_pages, splits_start_idxs = self._split_by_tokens(doc.content)
+            else:
+                units, starts = self._split_into_units(doc.content, self.split_by)
+                text_splits, splits_pages, splits_start_idxs = self._concatenate_units(
+                    units, starts, self.split_length, self.split_overlap, self.split_threshold
+                )
             metadata = deepcopy(doc.meta)
             metadata["source_id"] = doc.id
             if self.file_name is not None and self.file_name != '':
@@ -124,43 +135,32 @@ class RAGSplitter:
         return [s[i:i + length] for i in range(0, len(s), length)]
 
     def _split_into_units(self, text: str, split_by: Literal["word", "sentence", "passage", "page", "token", "custom"],
-                          max_length=1024) -> List[str]:
+                          max_length=1024) -> Tuple[List[str], List[int]]:
+        """
+        返回 (units, starts)，starts 为每个 unit 在 text 中的起始位置
+        """
         if split_by == "page":
             self.split_at = "\f"
         elif split_by == "passage":
             self.split_at = "\n\n"
         elif split_by == "sentence":
-            self.split_at = r'[,，.。]+'
+            self.split_at = SENTENCE_DELIMITERS
         elif split_by == "word":
             self.split_at = " "
         elif split_by == "custom":
             pass
         else:
             raise NotImplementedError(
-                "DocumentSplitter only supports 'word', 'sentence', 'page' or 'passage' split_by options."
+                "_split_into_units only supports 'word', 'sentence', 'page', 'passage' or 'custom' split_by options, "
+                "'token' is handled by _split_by_tokens."
             )
 
+        if split_by == "sentence":
+            return self._split_sentences(text, max_length)
+
         units = []
         try:
-            if split_by == "sentence":
-                result = re.split(self.split_at, text)
-                for (i, r) in enumerate(result):
-                    if r == '':
-                        continue
-                    index = text.index(r)
-                    if index + len(r) >= len(text):
-                        units.append(r)
-                        break
-                    limiter = text[index + len(r)]
-                    unit = r + limiter
-
-                    if len(unit) > max_length:
-                        splited = self.split_string(s=unit, length=max_length)
-                        units.extend(splited)
-                        continue
-
-                    units.append(unit)
-            elif split_by == "custom":
+            if split_by == "custom":
                 units = re.split(self.split_at, text)
             else:
                 units = text.split(self.split_at)
@@ -169,10 +169,99 @@ class RAGSplitter:
         except Exception as e:
             print(e)
 
-        return units
+        starts = []
+        position = 0
+        for unit in units:
+            starts.append(position)
+            position += len(unit)
+        return units, starts
+
+    def _split_sentences(self, text: str, max_length: int) -> Tuple[List[str], List[int]]:
+        """
+        单次扫描按句切分，每个 unit 为 句子 + 其后连续的分隔符，所有 unit 拼接后等于原文
+        超过 max_length 的句子按 max_length 切开
+        """
+        units = []
+        starts = []
+        position = 0
+        for match in re.finditer(self.split_at, text):
+            self._append_sentence(text, position, match.end(), max_length, units, starts)
+            position = match.end()
+        if position < len(text):
+            self._append_sentence(text, position, len(text), max_length, units, starts)
+        return units, starts
+
+    @staticmethod
+    def _append_sentence(text: str, start: int, end: int, max_length: int, units: List[str], starts: List[int]):
+        for i in range(start, end, max_length):
+            units.append(text[i:min(i + max_length, end)])
+            starts.append(i)
+
+    def _split_by_tokens(self, text: str, max_length=1024) -> Tuple[List[str], List[int], List[int]]:
+        """
+        按 token 数切分：先按句切分，再把连续的句子拼成不超过 split_length 个 token 的块，
+        相邻块重叠不超过 split_overlap 个 token 的完整句子；
+        单句超过 split_length 时(如没有标点的 OCR 表格)按 token 切成若干段，相邻段重叠 split_overlap 个 token
+        返回 (text_splits, splits_pages, splits_start_idxs)
+        """
+        budget = self.split_length
+        self.split_at = SENTENCE_DELIMITERS
+        sentences, sentence_starts = self._split_sentences(text, max_length)
+        spans = token_counter(self.tokenizer).spans(sentences)
+
+        units, starts, counts = [], [], []
+        for sentence, start, sentence_spans in zip(sentences, sentence_starts, spans):
+            if len(sentence_spans) <= budget:
+                units.append(sentence)
+                starts.append(start)
+                counts.append(len(sentence_spans))
+                continue
+            # 超长句子每段 budget 个 token，相邻段重叠 split_overlap 个 token，切分点为 token 起始位置
+            # 除最后一段外每段都占满 budget，不会与其他单元拼进同一块，重叠部分不会重复出现在一块中
+            stride = max(1, budget - self.split_overlap)
+            k = 0
+            while True:
+                end = min(k + budget, len(sentence_spans))
+                piece_start = sentence_spans[k][0] if k > 0 else 0
+                piece_end = sentence_spans[end][0] if end < len(sentence_spans) else len(sentence)
+                units.append(sentence[piece_start:piece_end])
+                starts.append(start + piece_start)
+                counts.append(end - k)
+                if end >= len(sentence_spans):
+                    break
+                k += stride
+
+        text_splits, splits_pages, splits_start_idxs = [], [], []
+        cur_page, page_idx = 1, 0
+        i = 0
+        while i < len(units):
+            j, total = i, 0
+            while j < len(units) and (j == i or total + counts[j] <= budget):
+                total += counts[j]
+                j += 1
+            # 块开头的分页符属于上一页的结尾，页码计到块内第一个非分页符字符
+            first = max(starts[i], page_idx)
+            while first < len(text) and text[first] == "\f":
+                first += 1
+            cur_page += text.count("\f", page_idx, first)
+            page_idx = first
+            text_splits.append("".join(units[i:j]))
+            splits_pages.append(cur_page)
+            splits_start_idxs.append(starts[i])
+            if j >= len(units):
+                break
+            # 下一块从末尾不超过 split_overlap 个 token 的句子开始，且至少前进一句；
+            # 重叠部分要给下一个单元留出位置，否则下一块只有重叠的句子
+            k, overlap = j, 0
+            limit = min(self.split_overlap, budget - counts[j])
+            while k - 1 > i and overlap + counts[k - 1] <= limit:
+                overlap += counts[k - 1]
+                k -= 1
+            i = k
+        return text_splits, splits_pages, splits_start_idxs
 
     def _concatenate_units(
-            self, elements: List[str], split_length: int, split_overlap: int, split_threshold: int
+            self, elements: List[str], starts: List[int], split_length: int, split_overlap: int, split_threshold: int
     ) -> Tuple[List[str], List[int], List[int]]:
         """
         Concatenates the elements into parts of split_length units.
@@ -180,16 +269,17 @@ class RAGSplitter:
         Keeps track of the original page number that each element belongs. If the length of the current units is less
         than the pre-defined `split_threshold`, it does not create a new split. Instead, it concatenates the current
         units with the last split, preventing the creation of excessively small splits.
+        `starts` holds the start offset of each element in the original text.
         """
 
         text_splits: List[str] = []
         splits_pages = []
         splits_start_idxs = []
-        cur_start_idx = 0
         cur_page = 1
-        segments = windowed(elements, n=split_length, step=split_length - split_overlap)
+        step = split_length - split_overlap
+        segments = windowed(elements, n=split_length, step=step)
 
-        for seg in segments:
+        for i, seg in enumerate(segments):
             current_units = [unit for unit in seg if unit is not None]
             txt = "".join(current_units)
 
@@ -201,10 +291,9 @@ class RAGSplitter:
             elif len(txt) > 0:
                 text_splits.append(txt)
                 splits_pages.append(cur_page)
-                splits_start_idxs.append(cur_start_idx)
+                splits_start_idxs.append(starts[i * step])
 
             processed_units = current_units[: split_length - split_overlap]
-            cur_start_idx += len("".join(processed_units))
 
             if self.split_by == "page":
                 num_page_breaks = len(processed_units)
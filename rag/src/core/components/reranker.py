@@ -1,37 +1,53 @@
 import aiohttp
 from haystack import Document
 
-from src.core.config import config
+from src.core.util.inference_client import inference_client
 
 
 class Reranker:
 
     async def run(self, query: str, documents: list[Document], top_n: int = 10, top_c: float = 0.1):
-        if len(documents) == 0:
-            return []
+        return (await self.run_batch([(query, documents)], top_n=top_n, top_c=top_c))[0]
+
+    async def run_batch(self, queries: list[tuple[str, list[Document]]], top_n: int = 10, top_c: float = 0.1):
+        """
+        多个查询的重排合并为一次 /rerank 请求
+        queries: [(查询, 该查询召回的文档)]
+        返回与 queries 一一对应的重排结果
+        """
         compare = [[query, f"{doc.meta['file_name']} \n {doc.content}" if 'file_name' in doc.meta else f"{doc.content}"]
-                   for doc in documents]
+                   for query, documents in queries for doc in documents]
+        if len(compare) == 0:
+            return [[] for _ in queries]
 
         scores = await self.rerank(compare)
-        for index, score in enumerate(scores):
-            documents[index].rerank_score = score
-        origin_sorted = sorted(documents, key=lambda doc: doc.rerank_score, reverse=True)
-        f = filter(lambda doc: doc.rerank_score > top_c, origin_sorted)
-        return list(f)[:top_n]
+        if isinstance(scores, dict):
+            raise ValueError(scores.get('error'))
+        if not isinstance(scores, list):
+            # 只有一对时推理服务返回的是单个分数
+            scores = [scores]
+
+        result = []
+        offset = 0
+        for _, documents in queries:
+            for doc, score in zip(documents, scores[offset:offset + len(documents)]):
+                doc.rerank_score = score
+            offset += len(documents)
+            origin_sorted = sorted(documents, key=lambda doc: doc.rerank_score, reverse=True)
+            f = filter(lambda doc: doc.rerank_score > top_c, origin_sorted)
+            result.append(list(f)[:top_n])
+        return result
 
     async def rerank(self, compare: [[str, str]]):
-        host = config.interface["inference"]
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(f"{host}/rerank",
-                                        timeout=-1,
-                                        json=compare,
-                                        headers={"Content-Type": "application/json"},
-                                        ) as response:
-                    response.raise_for_status()  # 检查 HTTP 错误
-                    data = await response.json()
-                    return data
-            except aiohttp.ClientError as e:
-                return {"error": f"HTTP error occurred: {str(e)}"}
-            except Exception as e:
-                return {"error": f"An error occurred: {str(e)}"}
+        try:
+            async with inference_client.post("rerank",
+                                             json=compare,
+                                             headers={"Content-Type": "application/json"},
+                                             params={"priority": "interactive"},
+                                             ) as response:
+                data = await response.json()
+                return data
+        except aiohttp.ClientError as e:
+            return {"error": f"HTTP error occurred: {str(e)}"}
+        except Exception as e:
+            return {"error": f"An error occurred: {str(e)}"}
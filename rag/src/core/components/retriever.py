@@ -1,3 +1,4 @@
+import asyncio
 import json
 import re
 from typing import List
@@ -12,6 +13,18 @@ from src.core.components.generator import Generator
 from src.core.components.milvus_manager import MilvusManager
 from src.core.entity.entity import Message, RetrieverConfig
 from src.core.util.decorators import retry_on_error
+from src.core.util.rewrite_cache import rewrite_cache
+
+# auto 重写模式的判断阈值
+AUTO_REWRITE_MAX_LENGTH = 24  # 超过该字符数的问题需要重写
+AUTO_REWRITE_MAX_TERMS = 8  # 稀疏向量词项超过该数量的问题需要重写
+AUTO_REWRITE_QUESTION_PATTERN = re.compile(
+    r"为什么|为何|如何|怎么|怎样|区别|对比|比较|关系|影响|原因|哪些|是否|吗|呢|？|\?"
+    r"|\b(why|how|what|which|compare|difference|versus|vs)\b", re.IGNORECASE)
+# 多轮对话中指代上文的词，需要结合上下文重写
+AUTO_REWRITE_REFERENCE_PATTERN = re.compile(
+    r"它|他们|她们|它们|这个|那个|这些|那些|上面|上述|前面|刚才|该|此"
+    r"|\b(it|they|this|that|these|those|above)\b", re.IGNORECASE)
 
 
 class Retriever:
@@ -21,6 +34,9 @@ class Retriever:
                  retriever_config: RetrieverConfig):
         self.sub_query_vectors = None
         self.keywords_vector = None
+        self.query_vector = None  # 原始问题的向量，推测检索时使用
+        self._speculative: dict[str, asyncio.Task] = {}
+        self._speculative_started: set[str] = set()
         self.llm = llm
         self.model = model
         if len(context) == 0:
@@ -35,17 +51,119 @@ class Retriever:
         self.ready = False
         self.embedder = FlagEmbedding()
         self.reranker = Reranker()
+        # 多知识库并发检索数量限制，推测检索和 vector_retrieval 共用
+        self.collection_slots = asyncio.Semaphore(max(1, retriever_config.collection_concurrency))
+
+    async def warm_up(self, collection_names: list[str] = None):
+        """
+        重写用户查询
+        collection_names: 需要检索的知识库，传入时在等待大模型重写的同时先用原始问题检索这些知识库
+        """
+        mode = self.retriever_config.rewrite_mode
+        # 原始问题的向量同时用于检索、auto 模式判断和重写缓存的语义查找，只请求一次
+        query_embedding = asyncio.create_task(self.embedder.run([self.query]))
+        rewrite_task = asyncio.create_task(self._rewrite_query(query_embedding)) if mode == "always" else None
+        try:
+            query_vector = (await query_embedding)[0]
+            if rewrite_task is None:
+                if mode == "off" or not self._need_rewrite(query_vector):
+                    # 跳过重写，直接使用原始问题的密集和稀疏向量检索
+                    self.keywords = self.query
+                    self.keywords_vector = query_vector
+                    self.sub_query_vectors = [query_vector]
+                    self.ready = True
+                    return self
+                rewrite_task = asyncio.create_task(self._rewrite_query(query_embedding))
+
+            # 推测检索：重写进行中先用原始问题检索，结果在 vector_retrieval 中与子查询的结果合并
+            self.query_vector = query_vector
+            for collection_name in collection_names or []:
+                self._speculative[collection_name] = asyncio.create_task(
+                    self._speculative_search(query_vector, collection_name))
+
+            try:
+                if self.retriever_config.rewrite_timeout > 0:
+                    await asyncio.wait_for(rewrite_task, self.retriever_config.rewrite_timeout)
+                else:
+                    await rewrite_task
+            except asyncio.TimeoutError:
+                # 重写超时，只使用原始问题的检索结果
+                self.keywords = self.query
+                self.keywords_vector = query_vector
+                self.sub_query = []
+                self.sub_query_vectors = []
+                self.ready = True
+                return self
+
+            if len(self.filenames) > 0:
+                # 推测检索没有按文件名过滤，丢弃结果，由 vector_retrieval 带过滤条件重新检索
+                self.cancel_speculative()
 
-    async def warm_up(self):
-        """重写用户查询"""
-        await self._rewrite_query()
-        self.keywords_vector = (await self.embedder.run([self.keywords]))[0]
-        self.sub_query_vectors = (await self.embedder.run(self.sub_query))
-        self.ready = True
-        return self
+            # 关键词只需要稀疏向量，子查询只需要密集向量，合并为一次请求
+            vectors = await self.embedder.run([self.keywords] + self.sub_query,
+                                              return_dense=[False] + [True] * len(self.sub_query),
+                                              return_sparse=[True] + [False] * len(self.sub_query))
+            self.keywords_vector = vectors[0]
+            self.sub_query_vectors = vectors[1:]
+            self.ready = True
+            return self
+        finally:
+            if not self.ready:
+                if rewrite_task is not None:
+                    rewrite_task.cancel()
+                self.cancel_speculative()
+
+    async def _speculative_search(self, query_vector: dict, collection_name: str):
+        """原始问题的推测检索，与 vector_retrieval 共用知识库并发限制"""
+        async with self.collection_slots:
+            self._speculative_started.add(collection_name)
+            return await self._search(query_vector, query_vector, collection_name=collection_name, _filter="")
+
+    def cancel_speculative(self):
+        """取消未被 vector_retrieval 取走的推测检索"""
+        for task in self._speculative.values():
+            task.cancel()
+        self._speculative.clear()
+
+    def _need_rewrite(self, query_vector: dict) -> bool:
+        """
+        auto 模式下判断是否需要大模型重写
+        短小的关键词查询直接检索；问句、多轮对话中的指代、稀疏向量词项较多的复杂问题才重写
+        """
+        query = self.query.strip()
+        if len(query) > AUTO_REWRITE_MAX_LENGTH:
+            return True
+        if len(query_vector['sparse']) > AUTO_REWRITE_MAX_TERMS:
+            return True
+        if AUTO_REWRITE_QUESTION_PATTERN.search(query):
+            return True
+        if len(self.context) > 1 and AUTO_REWRITE_REFERENCE_PATTERN.search(query):
+            return True
+        return False
+
+    async def _rewrite_query(self, query_embedding: asyncio.Task):
+        """
+        重写query，相同或相近的问题直接使用缓存的重写结果
+        query_embedding: warm_up 中原始问题的向量请求，语义查找缓存时复用
+        """
+        if rewrite_cache is None:
+            self._apply_rewrite(await self._rewrite_query_by_llm())
+            return
+
+        key, context_key = rewrite_cache.keys(self.query, self.context[:-1], self.model)
+        r = rewrite_cache.get(key)
+        dense = None
+        if r is None and rewrite_cache.semantic_threshold > 0:
+            dense = (await query_embedding)[0]['dense']
+            r = rewrite_cache.get_similar(context_key, dense)
+        if r is None:
+            rewrite_cache.miss()
+            r = await self._rewrite_query_by_llm()
+            rewrite_cache.put(key, context_key, r, dense)
+        self._apply_rewrite(r)
 
     @retry_on_error(max_retries=5, delay=2)
-    async def _rewrite_query(self):
+    async def _rewrite_query_by_llm(self) -> dict:
         """
         重写query
         1.提取query中的关键信息，比如用户提供的文档名称等元数据。
@@ -94,9 +212,11 @@ class Retriever:
             }], model=self.model
         )
         json_str = re.search(r'```json\n(.*?)\n```', response['message']['content'], re.DOTALL).group(1)
-        r = json.loads(json_str)
+        return json.loads(json_str)
 
-        self.sub_query = r['vector_prompts'] if len(r['vector_prompts']) > 0 else [self.query]
+    def _apply_rewrite(self, r: dict):
+        """将重写结果设置为子查询、关键词和文件名"""
+        self.sub_query = list(r['vector_prompts']) if len(r['vector_prompts']) > 0 else [self.query]
         keywords = ""
         if len(r['BM25_params']['keywords']) > 0:
             keywords = ','.join(r['BM25_params']['keywords'])
@@ -107,7 +227,7 @@ class Retriever:
         self.keywords = keywords if len(keywords) > 0 else self.query
 
         if 'filenames' in r:
-            self.filenames = r['filenames']
+            self.filenames = list(r['filenames'])
 
     @retry_on_error(max_retries=5, delay=2)
     async def vector_retrieval(self, collection_name: str):
@@ -115,44 +235,39 @@ class Retriever:
         if self.ready is False:
             raise ValueError("请先调用warm_up方法")
 
-        result = []
-        for sub_query_vector in self.sub_query_vectors:
-            datas = [
-                {
-                    "field_name": "vector",
-                    "vector": [sub_query_vector['dense']],
-                    "param": {
-                        "metric_type": "COSINE",
-                    },
-                    "weight": 1 - self.retriever_config.keyword_weight,
-                },
-                {
-                    "field_name": "sparse_vector",
-                    "vector": [self.keywords_vector['sparse']],
-                    "param": {
-                        "metric_type": "IP",
-                    },
-                    "weight": self.retriever_config.keyword_weight
-                }
-            ]
-
-            _filter = ""
-            for filename in self.filenames:
-                _filter += f"TEXT_MATCH(file_name, '{filename}') OR "
-
-            if _filter != "":
-                _filter = _filter[:-4]
-
-            r = await self._hybrid_retrieval_from_milvus(datas=datas, _filter=_filter,
-                                                         collection_name=collection_name)
-            docs = self._milvus_obj_to_doc(r)
-            docs = await self.reranker.run(sub_query_vector['text'], docs, self.retriever_config.rerank_top_k,
-                                           self.retriever_config.rerank_similarity_threshold)
-            docs = self._reorder(docs)
-            result.extend(docs)
-
-        # 根据文档id 去重
-        result = list({d.id: d for d in result}.values())
+        _filter = ""
+        for filename in self.filenames:
+            _filter += f"TEXT_MATCH(file_name, '{filename}') OR "
+
+        if _filter != "":
+            _filter = _filter[:-4]
+
+        # 所有子查询并发检索
+        searches = [self._search(sub_query_vector, self.keywords_vector, collection_name=collection_name,
+                                 _filter=_filter)
+                    for sub_query_vector in self.sub_query_vectors]
+        if self.query_vector is not None:
+            # 合并原始问题的推测检索结果，推测检索未启动或失败重试时补充检索
+            speculative = self._speculative.pop(collection_name, None)
+            if speculative is not None and not speculative.done() \
+                    and collection_name not in self._speculative_started:
+                # 调用方已占用并发名额，等待仍在排队的推测检索可能互相阻塞，改为直接检索
+                speculative.cancel()
+                speculative = None
+            if speculative is None:
+                speculative = self._search(self.query_vector, self.query_vector, collection_name=collection_name,
+                                           _filter=_filter)
+            searches.append(speculative)
+        hits = await asyncio.gather(*searches)
+
+        # 所有查询的候选文档按 id 合并去重，统一与用户原始问题重排一次，
+        # 保留条数与逐个子查询重排时相同(每个查询 rerank_top_k 条)
+        candidates = list({d.id: d for docs in hits for d in docs}.values())
+        reranked = await self.reranker.run(
+            self.query, candidates,
+            top_n=self.retriever_config.rerank_top_k * len(searches),
+            top_c=self.retriever_config.rerank_similarity_threshold)
+        result = self.reorder(reranked)
         # 找出所有excel表格 以source_id 去重代表同一个表格
         try:
             tables = list({d.meta['source_id']: d for d in [r for r in result if
@@ -163,7 +278,7 @@ class Retriever:
             if len(tables) > 0:
                 for doc in tables:
                     content = ""
-                    r = self._reorder(await self._windows_retrieval(doc, collection_name))
+                    r = self.reorder(await self._windows_retrieval(doc, collection_name))
                     for r in r:
                         content += r.content
                     doc.content = content
@@ -172,6 +287,34 @@ class Retriever:
             print(e)
         return result
 
+    async def _search(self, dense_vector: dict, sparse_vector: dict, collection_name: str,
+                      _filter: str) -> list[Document]:
+        """密集向量与稀疏向量混合检索"""
+        r = await self._hybrid_retrieval_from_milvus(datas=self._hybrid_datas(dense_vector, sparse_vector),
+                                                     _filter=_filter, collection_name=collection_name)
+        return self._milvus_obj_to_doc(r)
+
+    def _hybrid_datas(self, dense_vector: dict, sparse_vector: dict) -> list[dict]:
+        """查询的密集向量与关键词的稀疏向量组成混合检索参数"""
+        return [
+            {
+                "field_name": "vector",
+                "vector": [dense_vector['dense']],
+                "param": {
+                    "metric_type": "COSINE",
+                },
+                "weight": 1 - self.retriever_config.keyword_weight,
+            },
+            {
+                "field_name": "sparse_vector",
+                "vector": [sparse_vector['sparse']],
+                "param": {
+                    "metric_type": "IP",
+                },
+                "weight": self.retriever_config.keyword_weight
+            }
+        ]
+
     async def _windows_retrieval(self, doc: Document, collection_name: str, length: int = -1):
         """窗口检索
         length: -1 ~ 正无穷整数
@@ -191,8 +334,9 @@ class Retriever:
             collection_name=collection_name)
         return r
 
-    def _reorder(self, docs: []):
-        """将docs 按照文档的chunk顺序排列"""
+    @staticmethod
+    def reorder(docs: []):
+        """将docs 按照文档的chunk顺序排列，源文档按在 docs 中首次出现的顺序排列"""
         group = {}
         for d in docs:
             key = d.meta['source_id']
@@ -1,6 +1,7 @@
+import asyncio
 from io import BytesIO
 
-from haystack import AsyncPipeline
+from haystack import AsyncPipeline, Document
 from haystack.components.converters import TextFileToDocument, MarkdownToDocument, CSVToDocument
 from haystack.components.joiners import DocumentJoiner
 from haystack.components.routers import FileTypeRouter
@@ -36,10 +37,11 @@ class Spliter:
                   mime_type: str = "",
                   split_length=20,
                   split_overlap=4):
-        is_excel = False
-        if file_name.endswith(".xlsx") or file_name.endswith(".xls"):
-            is_excel = True
+        docs = await self.parse(data=data, file_name=file_name, mime_type=mime_type)
+        return await self.split(docs, split_length=split_length, split_overlap=split_overlap)
 
+    async def parse(self, data: bytes, file_name: str = "", mime_type: str = "") -> list[Document]:
+        """解析文件，返回未切分的文档"""
         l = file_name.split(".")
         if len(l) <= 1:
             raise ValueError("文件名不正确。")
@@ -47,13 +49,22 @@ class Spliter:
                                  meta={"file_name": file_name})
 
         self.file_name = file_name
-
-        self.spliter = self.init_split_pipe(split_length=split_length,
-                                            split_overlap=0 if is_excel else split_overlap,
-                                            file_name=file_name)
-        r = await self.spliter.run_async({"file_type_router": {
+        r = await self.init_parse_pipe().run_async({"file_type_router": {
             "sources": [byte_stream]}})
-        docs = r['splitter']['documents']
+        return r['doc_joiner']['documents']
+
+    async def split(self, docs: list[Document], split_length=20, split_overlap=4) -> list[Document]:
+        """切分 parse 返回的文档"""
+        is_excel = False
+        if self.file_name.endswith(".xlsx") or self.file_name.endswith(".xls"):
+            is_excel = True
+
+        self.spliter = self.init_splitter(split_length=split_length,
+                                          split_overlap=0 if is_excel else split_overlap,
+                                          file_name=self.file_name)
+        # 切分是 CPU 密集操作，放到线程中执行，不阻塞事件循环
+        r = await asyncio.to_thread(self.spliter.run, documents=docs)
+        docs = r['documents']
         if is_excel:
             # 如果是excel 将filename 换成 sheet_name
             for doc in docs:
@@ -71,9 +82,12 @@ class Spliter:
             (n['theme'], n['content'], f"{n['theme']}:{n['content']}") for n in themes
         ])
         """embedding 返回稀疏和密集向量"""
-        theme_vector = [r['dense'] for r in (await self.text_embedder.run(themes_title))]
-        content_vector = [r['dense'] for r in (await self.text_embedder.run(themes_content))]
-        sparse_vector = [r['sparse'] for r in (await self.text_embedder.run(themes_all_text))]
+        theme_vector = [r['dense'] for r in
+                        (await self.text_embedder.run(themes_title, return_sparse=False, priority="batch"))]
+        content_vector = [r['dense'] for r in
+                          (await self.text_embedder.run(themes_content, return_sparse=False, priority="batch"))]
+        sparse_vector = [r['sparse'] for r in
+                         (await self.text_embedder.run(themes_all_text, return_dense=False, priority="batch"))]
 
         for i in range(len(themes)):
             themes[i]['theme_vector'] = theme_vector[i]
@@ -82,9 +96,9 @@ class Spliter:
 
         return themes
 
-    def init_split_pipe(self, split_length, split_overlap, file_name):
+    def init_parse_pipe(self):
         """
-        初始化常规spliter
+        初始化文件解析 pipeline，按文件类型路由到各转换器
         """
         pipe = AsyncPipeline()
         pipe.add_component(
@@ -116,14 +130,6 @@ class Spliter:
         pipe.add_component("csv_converter", CSVToDocument())
         pipe.add_component("doc_joiner", DocumentJoiner())
 
-        if split_overlap >= split_length:
-            split_overlap = split_length - 1
-
-        pipe.add_component("splitter",
-                           RAGSplitter(split_by="sentence", split_length=split_length, split_overlap=split_overlap,
-                                       split_threshold=round(split_length / 2),
-                                       file_name=file_name))
-
         pipe.connect("file_type_router.text/plain", "text_converter.sources")
         pipe.connect("file_type_router.application/pdf", "pdf_converter.sources")
         pipe.connect("file_type_router.image/png", "png_converter.sources")
@@ -154,5 +160,24 @@ class Spliter:
         pipe.connect("xls_converter", "doc_joiner")
         pipe.connect("xlsx_converter", "doc_joiner")
         pipe.connect("csv_converter", "doc_joiner")
-        pipe.connect("doc_joiner", "splitter.documents")
         return pipe
+
+    def init_splitter(self, split_length, split_overlap, file_name) -> RAGSplitter:
+        """
+        初始化常规spliter
+        配置 splitter.split_by 为 token 时按 token 数切分，使用配置的 token_length / token_overlap
+        """
+        if config.splitter["split_by"] == "token":
+            return RAGSplitter(split_by="token",
+                               split_length=config.splitter["token_length"],
+                               # excel 等不需要重叠时 split_overlap 为 0
+                               split_overlap=config.splitter["token_overlap"] if split_overlap > 0 else 0,
+                               tokenizer=config.splitter["tokenizer"],
+                               file_name=file_name)
+
+        if split_overlap >= split_length:
+            split_overlap = split_length - 1
+
+        return RAGSplitter(split_by="sentence", split_length=split_length, split_overlap=split_overlap,
+                           split_threshold=round(split_length / 2),
+                           file_name=file_name)
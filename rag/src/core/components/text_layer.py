@@ -0,0 +1,91 @@
+"""
+文字层提取：有可用文字层的文档直接在本地解析，不再经过 OCR
+"""
+from io import BytesIO
+from typing import Optional
+
+from docx import Document as DocxDocument
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from pptx import Presentation
+from pypdf import PdfReader
+
+from src.core.config import config
+
+PDF = "application/pdf"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+PPTX = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+
+def usable(text: Optional[str]) -> bool:
+    """文字层是否可用：有效字符足够多，且乱码比例低"""
+    if text is None:
+        return False
+    chars = [c for c in text if not c.isspace()]
+    if len(chars) < config.text_layer["min_page_chars"]:
+        return False
+    bad = sum(1 for c in chars if c == "�" or not c.isprintable())
+    return bad / len(chars) < 0.1
+
+
+def extract_pdf_pages(data: bytes) -> list[Optional[str]]:
+    """返回 pdf 每页的文字层文本，文字层不可用的页为 None"""
+    pages = []
+    for page in PdfReader(BytesIO(data)).pages:
+        try:
+            text = page.extract_text()
+        except Exception:
+            text = None
+        pages.append(text if usable(text) else None)
+    return pages
+
+
+def _table_to_markdown(rows: list[list[str]]) -> str:
+    if len(rows) == 0:
+        return ""
+    rows = [[cell.replace("\n", " ").replace("|", "\\|") for cell in row] for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "---|" * len(rows[0])]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+
+def extract_docx(data: bytes) -> Optional[str]:
+    """按文档顺序提取 docx 的段落和表格，文字层不可用时返回 None"""
+    doc = DocxDocument(BytesIO(data))
+    blocks = []
+    for element in doc.element.body.iterchildren():
+        if element.tag.endswith("}p"):
+            paragraph = Paragraph(element, doc)
+            text = paragraph.text.strip()
+            if text == "":
+                continue
+            style = paragraph.style.name if paragraph.style is not None else ""
+            if style.startswith("Heading") and style[-1:].isdigit():
+                text = "#" * int(style[-1]) + " " + text
+            blocks.append(text)
+        elif element.tag.endswith("}tbl"):
+            table = Table(element, doc)
+            blocks.append(_table_to_markdown([[cell.text.strip() for cell in row.cells] for row in table.rows]))
+    text = "\n\n".join(blocks)
+    return text if usable(text) else None
+
+
+def extract_pptx(data: bytes) -> Optional[str]:
+    """
+    提取 pptx 每页幻灯片的文本和表格，有幻灯片没有文字层(如整页图片)时返回 None
+    """
+    slides = []
+    for slide in Presentation(BytesIO(data)).slides:
+        blocks = []
+        for shape in slide.shapes:
+            if shape.has_text_frame and shape.text_frame.text.strip() != "":
+                blocks.append(shape.text_frame.text.strip())
+            elif getattr(shape, "has_table", False) and shape.has_table:
+                blocks.append(_table_to_markdown([[cell.text.strip() for cell in row.cells]
+                                                  for row in shape.table.rows]))
+        text = "\n\n".join(blocks)
+        if text.strip() == "":
+            return None
+        slides.append(text)
+    text = "\n\n".join(slides)
+    return text if usable(text) else None
@@ -12,6 +12,42 @@ class Config:
             self.interface = _config['interface']
             self.mcp = _config['mcp']
             self.server = _config['server']
+            self.embedding_cache = {
+                "enable": True,
+                "model": "BAAI/bge-m3",
+                "path": "embedding_cache.sqlite3",
+                "max_entries": 500000,
+                **(_config.get('embedding_cache') or {}),
+            }
+            self.text_layer = {
+                "enable": True,
+                "min_page_chars": 32,
+                **(_config.get('text_layer') or {}),
+            }
+            self.rewrite_cache = {
+                "enable": True,
+                "max_entries": 2000,
+                "ttl": 3600,
+                "context_turns": 4,
+                "semantic_threshold": 0,
+                **(_config.get('rewrite_cache') or {}),
+            }
+            self.splitter = {
+                "split_by": "sentence",
+                "token_length": 512,
+                "token_overlap": 64,
+                "tokenizer": "./models/bge-m3/tokenizer.json",
+                **(_config.get('splitter') or {}),
+            }
+            self.analysis = {
+                "parse_workers": 2,
+                "split_workers": 1,
+                "embed_workers": 2,
+                "insert_workers": 1,
+                "queue_size": 4,
+                "embed_batch_size": 64,
+                **(_config.get('analysis') or {}),
+            }
 
 
 config = Config()
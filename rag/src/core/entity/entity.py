@@ -30,6 +30,9 @@ class RetrieverConfig(BaseModel):
     rerank_top_k: int = 20  # 重排召回数量
     rerank_similarity_threshold: float = 0.5  # 重排相似度阈值
     keyword_weight: float = 0.5  # 关键词权重
+    collection_concurrency: int = 4  # 多知识库并发检索数量
+    rewrite_mode: Literal["off", "always", "auto"] = "always"  # 查询重写模式，auto 时短关键词查询跳过大模型重写
+    rewrite_timeout: float = 0  # 查询重写超时(秒)，超时后只用原始问题的检索结果，0 为不限制
 
 
 class Params(BaseModel):
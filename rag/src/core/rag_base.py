@@ -1,3 +1,4 @@
+import asyncio
 import hashlib
 from typing import List
 
@@ -92,13 +93,20 @@ async def rag_chat(context: List[Message],
                                 llm=llm,
                                 model=model,
                                 retriever_config=retriever_config
-                                ).warm_up()
+                                ).warm_up(collection_names=collection_name)
     documents = []
 
     yield create_response_from_str("混合检索")
-    for index_name in collection_name:
-        vector_documents = await retriever.vector_retrieval(index_name)
-        documents.extend(vector_documents)
+
+    async def _retrieval(index_name: str):
+        async with retriever.collection_slots:
+            return await retriever.vector_retrieval(index_name)
+
+    try:
+        results = await asyncio.gather(*[_retrieval(index_name) for index_name in collection_name])
+    finally:
+        retriever.cancel_speculative()
+    documents.extend(_fuse_collection_results(results))
 
     metas = await get_documents_by_sourceIds(list(set(d.meta['source_id'] for d in documents)))
     for meta in metas:
@@ -213,6 +221,28 @@ async def file_chat(context: List[Message], reference: list[Reference], llm: Gen
         yield chunk
 
 
+def _fuse_collection_results(results: list[list[Document]]) -> list[Document]:
+    """
+    融合多个知识库的检索结果
+    不再做库内归一化：重排分数由同一个重排模型对同一问题打分，并已由 sigmoid 归一化到 0-1，各知识库之间可以直接比较，
+    库内 min-max 反而会把只有弱结果的知识库抬高到 1。
+    相同内容的文档只保留重排分数最高的一个，按分数排序后再按源文档分组、组内按分块顺序排列，
+    分组按组内最高分排序，保证相邻分块按原文顺序进入提示词
+    """
+    if len(results) == 1:
+        # 单个知识库的结果已在 vector_retrieval 中排好序
+        return results[0]
+
+    fused = {}
+    for docs in results:
+        for doc in docs:
+            key = hashlib.md5(doc.content.encode('utf-8')).hexdigest()
+            if key not in fused or doc.rerank_score > fused[key].rerank_score:
+                fused[key] = doc
+
+    return Retriever.reorder(sorted(fused.values(), key=lambda doc: doc.rerank_score, reverse=True))
+
+
 def _clean_reference_response(reference: list[Reference]):
     """清理文档给到前端，去掉多余的meta信息"""
     for r in reference:
@@ -10,7 +10,9 @@ from src.server.entity import ChatFilesModel
 from src.core import rag_base
 from src.core.entity.entity import Message, Params
 from src.core.util import io_util
+from src.core.util.embedding_cache import embedding_cache
 from src.core.util.io_util import CHAT_FILE_FOLDER
+from src.core.util.rewrite_cache import rewrite_cache
 
 router = APIRouter(prefix="/api/rag_base", tags=["rag模型模块"])
 
@@ -56,3 +58,11 @@ async def rag_chat_stream(context: list[Message], params: Params,
     return StreamingResponse(
         rag_base.router(context=context, params=params, request=request),
         media_type="application/json")
+
+
+@router.get("/metrics")
+async def metrics():
+    return JSONResponse(status_code=200, content={"code": 200, "msg": "success", "data": {
+        "rewrite_cache": rewrite_cache.stats() if rewrite_cache is not None else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+    }})
@@ -1,4 +1,4 @@
-import time
+import asyncio
 from functools import wraps
 
 
@@ -14,7 +14,7 @@ def retry_on_error(max_retries=3, delay=1):
                     retries += 1
                     print(f"Error occurred: {e}. Retrying {retries}/{max_retries}...")
                     if retries < max_retries:
-                        time.sleep(delay)
+                        await asyncio.sleep(delay)
                     else:
                         raise  # 如果重试次数用完，抛出异常
 
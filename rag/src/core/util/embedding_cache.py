@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from src.core.config import config
+
+
+class EmbeddingCache:
+    """
+    嵌入向量缓存，key 为 模型id + 文本内容hash
+    使用本地 sqlite 持久化，超出容量时按最近访问时间淘汰(LRU)
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int = 500000):
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key TEXT PRIMARY KEY,
+                    dense BLOB,
+                    sparse TEXT,
+                    last_access REAL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache(last_access)")
+            self._count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _get_many(self, keys: list[str]) -> dict[str, dict]:
+        with self._lock:
+            conn = self._connect()
+            result = {}
+            # sqlite 单条语句参数个数有限制，分批查询
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholder = ",".join(["?"] * len(chunk))
+                for key, dense, sparse in conn.execute(
+                        f"SELECT key, dense, sparse FROM embedding_cache WHERE key IN ({placeholder})", chunk):
+                    result[key] = {"dense": np.frombuffer(dense, dtype=np.float32),
+                                   "sparse": {int(k): v for k, v in json.loads(sparse).items()}}
+            if len(result) > 0:
+                now = time.time()
+                conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE key = ?",
+                                 [(now, key) for key in result])
+                conn.commit()
+            return result
+
+    def _put_many(self, items: dict[str, dict]):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.executemany("INSERT OR REPLACE INTO embedding_cache (key, dense, sparse, last_access) "
+                             "VALUES (?, ?, ?, ?)",
+                             [(key, np.asarray(v['dense'], dtype=np.float32).tobytes(),
+                               json.dumps({int(k): float(w) for k, w in v['sparse'].items()}), now)
+                              for key, v in items.items()])
+            self._count += len(items)
+            if self._count > self.max_entries:
+                # 淘汰到容量的 90%，避免每次写入都触发淘汰
+                self._count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+                evict = self._count - int(self.max_entries * 0.9)
+                if evict > 0:
+                    conn.execute("DELETE FROM embedding_cache WHERE key IN "
+                                 "(SELECT key FROM embedding_cache ORDER BY last_access LIMIT ?)", (evict,))
+                    self._count -= evict
+            conn.commit()
+
+    async def get_many(self, texts: list[str]) -> dict[str, dict]:
+        """返回命中的 {文本: {dense, sparse}}"""
+        keys = {self.key(t): t for t in texts}
+        found = await asyncio.to_thread(self._get_many, list(keys))
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return {keys[k]: v for k, v in found.items()}
+
+    async def put_many(self, items: dict[str, dict]):
+        """写入 {文本: {dense, sparse}}"""
+        if len(items) == 0:
+            return
+        await asyncio.to_thread(self._put_many, {self.key(t): v for t, v in items.items()})
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+            "entries": self._count,
+        }
+
+
+embedding_cache = EmbeddingCache(path=config.embedding_cache["path"],
+                                 model=config.embedding_cache["model"],
+                                 max_entries=config.embedding_cache["max_entries"]) \
+    if config.embedding_cache["enable"] else None
@@ -0,0 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+from typing import Optional
+
+import aiohttp
+
+from src.core.config import config
+
+
+class InferenceClient:
+    """
+    推理服务客户端，整个应用共享一个 aiohttp 会话。
+    1.长连接复用，避免每次请求都新建 TCP 连接和 DNS 解析。
+    2.按接口限制并发数。
+    3.按接口配置超时时间。
+    """
+
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphores: dict[str, asyncio.Semaphore] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def host(self) -> str:
+        return config.interface["inference"]
+
+    async def start(self):
+        """创建共享会话，在应用启动时调用；未启动时首次请求会自动创建"""
+        async with self._lock:
+            if self.session is not None and not self.session.closed:
+                return
+            pool = config.interface.get("pool", {})
+            connector = aiohttp.TCPConnector(
+                limit=pool.get("limit", 100),
+                limit_per_host=pool.get("limit_per_host", 0),
+                keepalive_timeout=pool.get("keepalive_timeout", 60),
+                ttl_dns_cache=pool.get("ttl_dns_cache", 300),
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+            self.semaphores = {endpoint: asyncio.Semaphore(limit)
+                               for endpoint, limit in config.interface.get("concurrency", {}).items()}
+
+    async def close(self):
+        """关闭共享会话，在应用关闭时调用"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def _timeout(self, endpoint: str) -> aiohttp.ClientTimeout:
+        timeout = config.interface.get("timeout", {})
+        total = timeout.get(endpoint, timeout.get("default", 300))
+        return aiohttp.ClientTimeout(total=total, connect=timeout.get("connect", 10))
+
+    @asynccontextmanager
+    async def post(self, endpoint: str, **kwargs):
+        """
+        向推理服务发送 POST 请求
+        endpoint: 接口名称，如 embedding、rerank、ocr，同时作为并发限制和超时配置的 key
+        """
+        if self.session is None or self.session.closed:
+            await self.start()
+        async with self.semaphores.get(endpoint, nullcontext()):
+            async with self.session.post(f"{self.host}/{endpoint}", timeout=self._timeout(endpoint),
+                                         **kwargs) as response:
+                response.raise_for_status()  # 检查 HTTP 错误
+                yield response
+
+
+inference_client = InferenceClient()
@@ -0,0 +1,98 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from src.core.config import config
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class RewriteCache:
+    """
+    查询重写结果缓存，TTL 过期 + LRU 淘汰
+    key 由 归一化后的问题、最近几轮上下文、模型名 组成。
+    semantic_threshold > 0 时，精确未命中会再用问题的密集向量在相同上下文的缓存中找余弦相似度超过阈值的结果。
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 3600, context_turns: int = 4,
+                 semantic_threshold: float = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.context_turns = context_turns
+        self.semantic_threshold = semantic_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        # key -> (过期时间, 上下文key, 问题向量, 重写结果)
+        self._entries: OrderedDict[str, tuple[float, str, Optional[np.ndarray], dict]] = OrderedDict()
+
+    def keys(self, question: str, context: list, model: str) -> tuple[str, str]:
+        """返回 (精确key, 上下文key)，context 为问题之前的对话"""
+        recent = context[-self.context_turns:] if self.context_turns > 0 else []
+        context_text = "\n".join(f"{c.role}:{_normalize(c.content)}" for c in recent)
+        context_key = hashlib.sha256(f"{model}\0{context_text}".encode("utf-8")).hexdigest()
+        key = hashlib.sha256(f"{context_key}\0{_normalize(question)}".encode("utf-8")).hexdigest()
+        return key, context_key
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.time():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def get_similar(self, context_key: str, dense) -> Optional[dict]:
+        """在相同上下文的缓存中查找语义相近的问题"""
+        if self.semantic_threshold <= 0 or dense is None:
+            return None
+        query = np.asarray(dense, dtype=np.float32)
+        now = time.time()
+        best_key, best_score = None, self.semantic_threshold
+        for key, (expire, _context_key, vector, _) in self._entries.items():
+            if expire < now or _context_key != context_key or vector is None:
+                continue
+            score = float(np.dot(query, vector) / (np.linalg.norm(query) * np.linalg.norm(vector) + 1e-12))
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        self.semantic_hits += 1
+        return self._entries[best_key][3]
+
+    def miss(self):
+        self.misses += 1
+
+    def put(self, key: str, context_key: str, value: dict, dense=None):
+        vector = np.asarray(dense, dtype=np.float32) if dense is not None else None
+        self._entries[key] = (time.time() + self.ttl, context_key, vector, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / total if total else 0,
+            "entries": len(self._entries),
+        }
+
+
+rewrite_cache = RewriteCache(max_entries=config.rewrite_cache["max_entries"],
+                             ttl=config.rewrite_cache["ttl"],
+                             context_turns=config.rewrite_cache["context_turns"],
+                             semantic_threshold=config.rewrite_cache["semantic_threshold"]) \
+    if config.rewrite_cache["enable"] else None
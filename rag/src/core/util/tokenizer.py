@@ -0,0 +1,64 @@
+"""
+token 计数：优先用 tokenizers 加载嵌入模型(bge-m3)本地的 tokenizer.json，
+文件不存在或加载失败时使用本地正则估算(中日韩按字、英文按最多5个字母、数字按最多3位计为一个token)
+切分在线程中执行，不从 huggingface 下载分词器，避免切分时访问网络
+"""
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+from src.core.config import config
+
+logger = logging.getLogger(__name__)
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_ESTIMATE = re.compile(rf"[{_CJK}]|[A-Za-z]{{1,5}}|\d{{1,3}}|[^\sA-Za-z\d{_CJK}]")
+
+
+class TokenCounter:
+
+    def __init__(self, name: str):
+        """name: 本地 tokenizer.json 路径"""
+        self.name = name
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return self._tokenizer
+            try:
+                from tokenizers import Tokenizer
+                if os.path.exists(self.name):
+                    self._tokenizer = Tokenizer.from_file(self.name)
+                else:
+                    logger.warning(f"分词器文件不存在，使用本地估算，name:{self.name}")
+            except Exception as e:
+                logger.warning(f"加载分词器失败，使用本地估算，name:{self.name},error info:{e}")
+            self._loaded = True
+            return self._tokenizer
+
+    def spans(self, texts: list[str]) -> list[list[tuple[int, int]]]:
+        """每个文本中每个 token 的字符区间 (start, end)，不含特殊 token"""
+        tokenizer = self._tokenizer if self._loaded else self._load()
+        if tokenizer is None:
+            return [[m.span() for m in _ESTIMATE.finditer(text)] for text in texts]
+        encodings = tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [[offset for offset in encoding.offsets if offset[1] > offset[0]] for encoding in encodings]
+
+    def count(self, texts: list[str]) -> list[int]:
+        return [len(s) for s in self.spans(texts)]
+
+
+_counters: dict[str, TokenCounter] = {}
+
+
+def token_counter(name: Optional[str] = None) -> TokenCounter:
+    """按分词器名称复用 TokenCounter，默认使用配置 splitter.tokenizer"""
+    name = name or config.splitter["tokenizer"]
+    if name not in _counters:
+        _counters[name] = TokenCounter(name)
+    return _counters[name]
@@ -1,5 +1,6 @@
 from src.server.entity.chat_history import *
 from src.server.entity.document import *
 from src.server.entity.folder import *
+from src.server.entity.ingestion_job import *
 from src.server.entity.knowledge import *
 from src.server.entity.user import *
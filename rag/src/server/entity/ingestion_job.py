@@ -0,0 +1,25 @@
+from src.server.entity.common import fields, ApplyTable
+
+
+class IngestionJobModel(ApplyTable):
+    """
+    文档入库任务模型类，记录每个文档在入库流水线中的进度，服务重启后从最后完成的阶段继续
+    """
+    k_id = fields.IntField(description="知识库id，关联知识库表")
+    d_id = fields.IntField(description="文档id，关联文档表")
+    collection_name = fields.CharField(max_length=255, description="向量库索引名称")
+    file_path = fields.CharField(max_length=768, description="文件路径")
+    file_name = fields.CharField(max_length=255, description="文件名")
+    mime_type = fields.CharField(max_length=255, description="文件类型")
+    split_length = fields.IntField(description="分割长度")
+    split_overlap = fields.IntField(description="分割重叠")
+    stage = fields.SmallIntField(description="0:排队中 1.已解析 2.已切分 3.已完成", default=0)
+    documents = fields.JSONField(description="解析结果，未切分的文档", null=True)
+    chunks = fields.JSONField(description="切分结果", null=True)
+    inserted = fields.IntField(description="已嵌入并写入向量库的分块数", default=0)
+    inserted_ids = fields.JSONField(description="已写入向量库的主键", null=True)
+
+    class Meta:
+        table = "sys_ingestion_job"
+        table_description = "文档入库任务表"
+        unique_together = (("k_id", "d_id"),)
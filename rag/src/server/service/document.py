@@ -5,7 +5,7 @@ from tortoise.contrib.pydantic import pydantic_model_creator
 from tortoise.exceptions import DoesNotExist
 from tortoise.transactions import atomic, in_transaction
 
-from src.server.entity import DocumentModel, KnowledgeDocumentModel
+from src.server.entity import DocumentModel, KnowledgeDocumentModel, IngestionJobModel
 from src.server.schemas.common import QueryData, ListAll
 from src.server.schemas.document import DocumentOut, KnowledgeDocumentOut, DocumentClassification
 from src.core.util import io_util
@@ -58,6 +58,7 @@ async def delete_document(document_id: int):
 
     # 根据文件Id删除掉该文件所在的所有知识库的记录
     await KnowledgeDocumentModel.filter(d_id=document_id).delete()
+    await IngestionJobModel.filter(d_id=document_id).delete()
 
     await document_obj.delete()
     await io_util.remove_files([document_obj.path])
@@ -140,6 +141,7 @@ async def delete_documents_by_knowledge(knowledge_id, document_ids, request: Req
 
     # 删除知识库文档
     await KnowledgeDocumentModel.filter(k_id=knowledge_id, d_id__in=document_ids).delete()
+    await IngestionJobModel.filter(k_id=knowledge_id, d_id__in=document_ids).delete()
 
     if len(source_ids) > 0:
         try:
@@ -9,7 +9,7 @@ from tortoise.transactions import in_transaction
 
 from src.core.components.analysis_task import VectorTask, AnalysisTask
 from src.core.util import io_util
-from src.server.entity import FolderModel, DocumentModel, KnowledgeDocumentModel, KnowledgeModel
+from src.server.entity import FolderModel, DocumentModel, KnowledgeDocumentModel, KnowledgeModel, IngestionJobModel
 from src.server.schemas import common as BaseSchema
 from src.server.schemas.common import QueryData
 from src.server.schemas.document import FolderIn, FolderOut, FolderWithDocumentsOut, DocumentBasic, \
@@ -51,12 +51,13 @@ async def delete_folder(folder_id: int):
     async with in_transaction() as con:
         # 根据文件Id删除掉该文件所在的所有知识库的记录
         rm = KnowledgeDocumentModel.filter(d_id__in=[doc.id for doc in documents]).using_db(con).delete()
+        rmj = IngestionJobModel.filter(d_id__in=[doc.id for doc in documents]).using_db(con).delete()
         # 删除数据库中的文件记录
         rma = DocumentModel.filter(folder_id=folder_id).using_db(con).delete()
         # 删除文件夹记录
         rmb = FolderModel.filter(id=folder_id).using_db(con).delete()
         # 使用 asyncio.gather 并设置 return_exceptions=True 处理失败
-        await asyncio.gather(rm, rma, rmb, return_exceptions=True)
+        await asyncio.gather(rm, rmj, rma, rmb, return_exceptions=True)
 
         await io_util.remove_files([document.path for document in documents])
 
@@ -160,6 +161,8 @@ async def analysis_document(document_analysis: DocumentAnalysis, task: AnalysisT
 
         documentIds = document_analysis.documentIds
         knowledge_id = document_analysis.knowledge_id
+        # 已在排队或解析中的文档不重新入队，也不修改状态
+        skipped = []
         try:
             for document_id in documentIds:
                 document = await KnowledgeDocumentModel.filter(d_id=document_id, k_id=knowledge_id).using_db(
@@ -168,7 +171,7 @@ async def analysis_document(document_analysis: DocumentAnalysis, task: AnalysisT
                     raise HTTPException(status_code=404, detail="没有找到相关文档")
 
                 document_info = await DocumentModel.get(id=document_id).using_db(conn)
-                await task.add_vector_task(
+                skipped += await task.add_vector_task(
                     [VectorTask(collection_name=index_name, file_path=document_info.path, file_name=document_info.name,
                                 d_id=document_info.id, k_id=document_analysis.knowledge_id,
                                 mimetype=document_info.mime_type,
@@ -177,8 +180,9 @@ async def analysis_document(document_analysis: DocumentAnalysis, task: AnalysisT
                                 )]
                 )
 
-            await KnowledgeDocumentModel.filter(d_id__in=documentIds, k_id=knowledge_id).update(status_code=0,
-                                                                                                status_text="排队中")
+            queued = [d_id for d_id in documentIds if (knowledge_id, d_id) not in skipped]
+            await KnowledgeDocumentModel.filter(d_id__in=queued, k_id=knowledge_id).update(status_code=0,
+                                                                                           status_text="排队中")
         except DoesNotExist:
             raise HTTPException(status_code=404, detail="查询对象不存在")
         except Exception as e:
@@ -7,7 +7,7 @@ from tortoise.exceptions import DoesNotExist
 from tortoise.transactions import in_transaction
 
 from src.core.components.milvus_manager import MilvusManager
-from src.server.entity import KnowledgeModel, KnowledgeDocumentModel
+from src.server.entity import KnowledgeModel, KnowledgeDocumentModel, IngestionJobModel
 from src.server.schemas.common import QueryData
 from src.server.schemas.knowledge import KnowledgeIn, KnowledgeOut
 
@@ -130,6 +130,7 @@ async def delete_knowledge(knowledge_id: int, milvus_manager: MilvusManager):
             raise ValueError("知识库未找到")
         await asyncio.gather(
             KnowledgeDocumentModel.filter(k_id=knowledge_id).using_db(connection).delete(),
+            IngestionJobModel.filter(k_id=knowledge_id).using_db(connection).delete(),
             KnowledgeModel.filter(id=knowledge_id).using_db(connection).delete(),
         )
         await milvus_manager.drop_collection(knowledge.index_name)